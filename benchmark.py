@@ -0,0 +1,195 @@
+#Benchmark for the tileset ripper (readtileset.py)
+#It runs on synthetic save states filled with random VRAM, CGRAM and tilemap data, so no copyrighted save state is needed
+#Every stage of drawing a tileset is timed on its own (both the default indexed PNG and the --rgb path), and the result is checked pixel by pixel against the original bit-by-bit implementation
+#OpenCV is optional here too: the indexed PNG is checked with a small decoder in this script, and the cv2 stage is only run when OpenCV is installed
+#Command line example: benchmark.py --states 4 --repeat 5
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import struct
+import zlib
+import readtileset
+from savestate import SaveState, stateSize, stateOffset, vramAddress, vramSize, cgramAddress, tilemapAddress, tilemapSize, levelIndexAddress
+
+#Creates a save state where VRAM, CGRAM and the tilemap are random, the same seed always gives the same save state
+#charAmt limits how many different VRAM characters the tilemap points at, real levels reuse characters a lot more than random data does
+def makeState(fileName, seed, charAmt=1024):
+    rng = random.Random(seed)
+    data = bytearray(stateSize)
+    vram = stateOffset+vramAddress
+    data[vram:vram+vramSize] = rng.randbytes(vramSize)
+    cgram = stateOffset+cgramAddress
+    data[cgram:cgram+(8*32)] = rng.randbytes(8*32)
+    tilemap = stateOffset+tilemapAddress
+    i = 0
+    while i < tilemapSize:
+        entry = rng.randrange(charAmt) | (rng.randrange(64) << 10)     #10-bit VRAM address, then palette, priority and mirroring flags
+        data[tilemap+i] = entry & 255
+        data[tilemap+i+1] = entry >> 8
+        i += 2
+    data[stateOffset+levelIndexAddress] = seed % len(readtileset.lName)
+    with open(fileName, "wb") as f:
+        f.write(data)
+
+#The original way of drawing a tileset, one pixel at a time with the reference functions in readtileset.py
+#This is slow, but it's what every faster version has to match
+def drawReferenceTile(state, tileIndex):
+    fullTile = readtileset.swapEndian(list(state.tilemap[tileIndex*32:(tileIndex*32)+32]))
+    colTableByte = readtileset.byteToIntList(readtileset.swapEndian(list(state.cgram[:8*32])))
+    colorTable = []
+    x = 0
+    while x < 16:
+        tileAdr = fullTile[(x*2)+1]+(fullTile[x*2]*256)
+        tilePal = (tileAdr & 7168) >> 10
+        vMirror = tileAdr & 32768
+        hMirror = tileAdr & 16384
+        tileAdr = tileAdr & 1023
+        partTile = readtileset.drawChar(list(state.vram[tileAdr*32:(tileAdr*32)+32]))
+        if hMirror != 0:
+            partTile = [list(reversed(i)) for i in partTile]
+        if vMirror != 0:
+            partTile = list(reversed(partTile))
+        for i in partTile:
+            for m in i:
+                if m == 0:
+                    B,G,R = 1,1,1
+                else:
+                    B,G,R = readtileset.splitColorByte(colTableByte[m+(tilePal*16)])
+                    B = int((B * 255) / 31)
+                    G = int((G * 255) / 31)
+                    R = int((R * 255) / 31)
+                colorTable.append((B,G,R))
+        x += 1
+    tile = []                                               #Characters come in order, so put the rows of every 4 characters next to each other
+    for z in range(4):
+        for y in range(8):
+            for x in range(4):
+                tile.extend(colorTable[(z*256)+(y*8)+(64*x):(z*256)+(y*8)+(64*x)+8])
+    return tile
+
+def drawReferenceSheet(state):
+    import numpy as np
+    sheet = np.empty((16, 32, 16, 32, 3), dtype=np.uint8)
+    for slot in range(256):
+        sheet[slot // 16, :, slot % 16] = np.asarray(drawReferenceTile(state, slot+1), dtype=np.uint8).reshape(32, 32, 3)
+    return sheet.reshape(512, 512, 3)
+
+#Decodes an indexed PNG made by readtileset.encodeIndexedPNG back into a BGR sheet, so it can be checked without OpenCV
+#Only what encodeIndexedPNG writes is supported (8-bit indexed, no interlacing, filter type 0 on every row). Raises a ValueError if the PNG is damaged
+def decodeIndexedPNG(png):
+    import numpy as np
+    if png[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("Not a PNG file")
+    chunks = {}
+    i = 8
+    while i < len(png):
+        length, chunkType = struct.unpack(">I4s", png[i:i+8])
+        data = png[i+8:i+8+length]
+        if struct.unpack(">I", png[i+8+length:i+12+length])[0] != zlib.crc32(chunkType + data):
+            raise ValueError("CRC of the {0} chunk does not match".format(chunkType.decode("ascii")))
+        chunks[chunkType] = chunks.get(chunkType, b"") + data     #IDAT may be split over several chunks
+        i += 12 + length
+    width, height, bitDepth, colorType = struct.unpack(">IIBB", chunks[b"IHDR"][:10])
+    if (bitDepth != 8) or (colorType != 3):
+        raise ValueError("Only 8-bit indexed PNGs are supported")
+    rows = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8).reshape(height, width+1)
+    if rows[:, 0].any():
+        raise ValueError("Only filter type 0 is supported")
+    palette = np.frombuffer(chunks[b"PLTE"], dtype=np.uint8).reshape(-1, 3)[:, ::-1]   #PNG palettes are RGB, the sheets are BGR
+    return palette[rows[:, 1:]]
+
+#Runs a stage a few times and keeps the fastest time, which is the least affected by whatever else the computer is doing
+def timeStage(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if (best == None) or (elapsed < best):
+            best = elapsed
+    return result, best
+
+def runBenchmark(stateAmt=4, repeat=5, seed=1, charAmt=1024, reference=True):
+    import numpy as np
+    try:                                        #OpenCV is optional, just like in readtileset.py. Without it, the cv2 PNG stage is left out
+        import cv2
+    except ImportError:
+        cv2 = None
+        print("OpenCV is not installed, the RGB PNG encode (cv2) stage is skipped\n")
+    stages = ["Planar decode", "Palette conversion", "Tile assembly", "PNG encode", "Total", "RGB tile assembly"]
+    if cv2 != None:
+        stages.append("RGB PNG encode (cv2)")
+    if reference:
+        stages.append("Reference (original)")
+    times = dict.fromkeys(stages, 0.0)
+    pngSize = 0
+    rgbPngSize = 0
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(stateAmt):
+            fileName = os.path.join(folder, "synthetic{0}.bst".format(i))
+            makeState(fileName, seed+i, charAmt)
+            state = SaveState(fileName)
+            charTable, elapsed = timeStage(lambda: readtileset.readCharTable(state), repeat)
+            times["Planar decode"] += elapsed
+            palette, elapsed = timeStage(lambda: readtileset.readPalette(state), repeat)
+            times["Palette conversion"] += elapsed
+            indexSheet, elapsed = timeStage(lambda: readtileset.drawTileset(state, readtileset.readIndexTable(), False, charTable), repeat)
+            times["Tile assembly"] += elapsed
+            png, elapsed = timeStage(lambda: readtileset.encodeIndexedPNG(indexSheet, palette), repeat)
+            times["PNG encode"] += elapsed
+            sheet, elapsed = timeStage(lambda: readtileset.drawTileset(state, palette, False, charTable), repeat)
+            times["RGB tile assembly"] += elapsed
+            if not np.array_equal(decodeIndexedPNG(png), sheet):
+                print("ERROR: Indexed PNG of synthetic state",i,"does not decode back to the same colors as the RGB sheet")
+                return False
+            pngSize += len(png)
+            if cv2 != None:
+                rgbPng, elapsed = timeStage(lambda: cv2.imencode(".png", sheet)[1], repeat)
+                times["RGB PNG encode (cv2)"] += elapsed
+                if not np.array_equal(cv2.imdecode(rgbPng, cv2.IMREAD_COLOR), sheet):
+                    print("ERROR: RGB PNG of synthetic state",i,"does not decode back to the same sheet")
+                    return False
+                if not np.array_equal(cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_COLOR), sheet):
+                    print("ERROR: Indexed PNG of synthetic state",i,"does not decode back to the same colors in OpenCV")
+                    return False
+                rgbPngSize += len(rgbPng)
+            if reference:
+                referenceSheet, elapsed = timeStage(lambda: drawReferenceSheet(state), 1)
+                times["Reference (original)"] += elapsed
+                if not np.array_equal(referenceSheet, sheet):
+                    diff = np.argwhere((referenceSheet != sheet).any(axis=2))
+                    print("ERROR: Synthetic state",i,"does not match the original implementation,",len(diff),"pixels differ, first at (y, x):",tuple(diff[0]))
+                    return False
+    times["Total"] = times["Planar decode"] + times["Palette conversion"] + times["Tile assembly"] + times["PNG encode"]
+    tileAmt = 256 * stateAmt
+    print("--BENCHMARK--",stateAmt,"synthetic save states,",tileAmt,"tiles, best of",repeat,"runs per stage\n")
+    print("{0:<24}{1:>12}{2:>16}".format("Stage", "Time (ms)", "Tiles/sec"))
+    for stage in stages:
+        print("{0:<24}{1:>12.2f}{2:>16.0f}".format(stage, times[stage]*1000, tileAmt/times[stage]))
+    if cv2 != None:
+        print("\nPNG size: indexed",pngSize // stateAmt,"bytes, RGB",rgbPngSize // stateAmt,"bytes on average")
+    else:
+        print("\nPNG size: indexed",pngSize // stateAmt,"bytes on average")
+    if reference:
+        print("\nSpeedup over the original implementation: {0:.1f}x".format(times["Reference (original)"]/times["Total"]))
+        print("All sheets are pixel-identical to the original implementation")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                        prog='Benchmark',
+                        description='Toy Story SNES Tileset Exporter benchmark - Times every stage of readtileset.py on synthetic save states.',
+                        epilog='Usage: benchmark --states --repeat --seed --chars --noreference')
+    parser.add_argument('--states', metavar='N', type=int, default=4, help='Amount of synthetic save states to create')
+    parser.add_argument('--repeat', metavar='R', type=int, default=5, help='Every stage is run this many times, the fastest run is used')
+    parser.add_argument('--seed', metavar='S', type=int, default=1, help='Seed of the first synthetic save state')
+    parser.add_argument('--chars', metavar='C', type=int, default=1024, help='Amount of different VRAM characters the tilemap points at (1-1024)')
+    parser.add_argument('--noreference', action='store_true', help='Skip the (slow) pixel comparison with the original implementation')
+    args = parser.parse_args()
+
+    if not runBenchmark(args.states, args.repeat, args.seed, args.chars, not args.noreference):
+        sys.exit(1)
@@ -0,0 +1,118 @@
+#This script estimates how big a Tiled map will be once it's packed into the ROM, so it can be run every time the map is saved
+#The estimate is the exact size that packing settings 0 of rnc.py give. A ROM export (level2state.py --exportmode 1) starts with those
+#settings and only switches to harder ones if they're smaller, so the level in ROM never ends up bigger than the estimate
+#This is only exact for the packer in rnc.py, the original RNC ProPack tool packs differently
+#Only the tile layer is read, without NumPy, so the whole run stays short enough to do on every save
+#Command line example: estimatesize.py %mapfile
+
+import re               #Used to find the level index in the name of the map file
+import os               #Used for some file read/write features
+import sys              #Used for some file read/write features
+import argparse         #Used to parse arguments so that this script can be used with Tiled's command feature
+import time             #Used to show how long the estimate took
+import rnc
+from tiledlayer import decodeLayer, joinChunks
+from level2state import lSize
+
+#Estimates the packed size of the level tiles (8192 bytes, as written to the ROM), returns the estimate in bytes
+def estimateSize(arrayLevel):
+    return rnc.packedSize(arrayLevel, 0)
+
+#Reads the level tiles from the tile layer of a Tiled map file, the same way as level2state.readMapFile but without NumPy or the creatures
+#Returns the level as bytes. Raises a ValueError if a tile doesn't fit in a level byte (the same checks as level2state.checkLevelData)
+def readLevelTiles(levelFile):
+    import xml.etree.ElementTree as ET
+    level = []
+    chunks = []
+    mapWidth = 0
+    mapHeight = 0
+    for event, elem in ET.iterparse(levelFile, events=("start", "end")):
+        if (event == "start") and (elem.tag == "map"):  #Map size is needed to put the chunks of an infinite map back together
+            mapWidth = int(elem.get("width", 0))
+            mapHeight = int(elem.get("height", 0))
+        elif (event == "end") and (elem.tag == "data"):
+            encoding = elem.get("encoding")
+            compression = elem.get("compression")
+            chunks = []
+            for chunk in elem.findall("chunk"):
+                tileGids = [int(tile.get("gid", 0)) for tile in chunk.findall("tile")]
+                if not tileGids:
+                    tileGids = decodeLayer(chunk.text or "", encoding, compression)
+                chunks.append((int(chunk.get("x")), int(chunk.get("y")), int(chunk.get("width")), int(chunk.get("height")), tileGids))
+            tileGids = [int(tile.get("gid", 0)) for tile in elem.findall("tile")]
+            if tileGids:
+                level = tileGids
+            elif not chunks:
+                level = decodeLayer(elem.text or "", encoding, compression)
+            elem.clear()
+        elif (event == "end") and (elem.tag in ("layer", "objectgroup", "tileset")):
+            elem.clear()
+    if chunks:
+        return bytes(joinChunks(chunks, mapWidth, mapHeight))
+    if (len(level) > 0) and ((max(level) > 255) or (min(level) < 0)):
+        value = max(level) if max(level) > 255 else min(level)
+        tileIndex = level.index(value)
+        if value == 256:
+            raise ValueError("Tile number {0} uses gid 256, the last tile of the tileset. Tile 256 is invalid and can not be stored in the level".format(tileIndex))
+        if value > 256:
+            raise ValueError("Tile number {0} uses gid {1}, which is not part of the level tileset (flipped or rotated tiles are not supported)".format(tileIndex, value))
+        raise ValueError("Tile number {0} has the negative value {1}".format(tileIndex, value))
+    return bytes(level)
+
+#Estimates the packed size of a Tiled map file and prints how many bytes are left in the ROM for level lIndex
+#Returns the amount of bytes left (negative if the level is too big), or None if the map can't be read
+def estimateLevel(levelFile, lIndex):
+    try:
+        arrayLevel = readLevelTiles(levelFile)
+    except (ValueError, SyntaxError) as error:
+        print("ERROR:",error)
+        return None
+    start = time.perf_counter()
+    packSize = estimateSize(arrayLevel)
+    elapsed = time.perf_counter() - start
+    bytesLeft = lSize[lIndex] - packSize
+    print("Estimated size of compressed level:",packSize,"bytes (at most, harder settings of rnc.py can only make it smaller) - Estimated in {0:.1f} ms".format(elapsed*1000))
+    if packSize >= lSize[lIndex]:                #Same check as the ROM export, the level has to be smaller than that of the original game
+        print("WARNING: Level is",packSize-lSize[lIndex]+1,"bytes over the budget of",lSize[lIndex],"bytes. The ROM export tries harder settings that may still make it fit")
+    else:
+        print("Bytes left:",bytesLeft,"of",lSize[lIndex])
+    return bytesLeft
+
+if __name__ == "__main__":
+    #Argument parser function
+    parser = argparse.ArgumentParser(
+                        prog='EstimateSize',
+                        description='Toy Story SNES Level Size Estimator - Estimate the compressed size of a Tiled map before exporting it to ROM.',
+                        epilog='Usage: estimatesize MAPFILE --level')
+
+    parser.add_argument('levelfile',
+                        metavar='L',
+                        help='Tiled level file to read from (.tmx)')
+                        #Tiled supports parsing the filename that it is currently editing into this script as %mapfile
+    parser.add_argument('--level',
+                        metavar='N',
+                        type=int,
+                        help='Level index (0-16). Read from the number at the start of the map file name if left out, such as 0 - That Old Army Game.tmx',
+                        required=False,
+                        default=None)
+
+    args = parser.parse_args()
+    levelFile = args.levelfile
+    lIndex = args.level
+
+    if lIndex == None:
+        number = re.match('[0-9]+', os.path.basename(levelFile))
+        if number == None:
+            print("ERROR: Can not find which level this is. Name the level file after the level (0-16) or use --level")
+            sys.exit()
+        lIndex = int(number.group(0))
+    if (lIndex < 0) or (lIndex > 16):
+        print("ERROR: Invalid level index!")
+        sys.exit()
+    if lSize[lIndex] == None:                       #Really Inside (3D level, self-explanatory) and The Claw (unknown as of know)
+        print("ERROR: Level not supported.")
+        sys.exit()
+
+    print("Level file:",levelFile,"\nLevel index:",lIndex)
+    if estimateLevel(levelFile, lIndex) == None:
+        sys.exit()
@@ -5,281 +5,17 @@ import re               #We need regex to help us search through the csv format
 import os               #Used for some file read/write features
 import sys              #Used for some file read/write features
 import argparse         #Used to parse arguments so that this script can be used with Tiled's command feature
-import subprocess
+import struct           #Used to pack the creature block
+from savestate import SaveState, stateSize, objectAddress, objectSize, levelAddress
+from tiledlayer import decodeLayer, decodeLayerArray, joinChunks
+from state2level import creatureEntry, creatureEntryByte
 
-#Argument parser function
-parser = argparse.ArgumentParser(
-                    prog='Level2State',
-                    description='Toy Story SNES Level Importer - Read a Tiled map and export it into a BSNES save state.',
-                    epilog='Usage: level2state INPUT OUTPUT MAPPATH')
-                    
-
-parser.add_argument('levelfile', 
-                    metavar='L',
-                    help='Tiled level file to read from (.tmx)')
-                    #Tiled supports parsing the filename that it is currently editing into this script as %mapfile
-parser.add_argument('statefile', 
-                    metavar='S',
-                    help='BSNES save state file to export to (.bst). ROM file if in mode 1')                     
-                    #The path to the save state has to be provided in full inside the command string
-parser.add_argument('levelpath', 
-                    metavar='P',
-                    help='Directory path to where the map is located') 
-                    #This can be sent directly from a Tiled variable called %mappath
-parser.add_argument('--exportmode', 
-                    metavar='M',
-                    help='Export mode (0-1). 0 if exporting to save state, 1 if exporting to ROM',
-                    required=False,
-                    default='0')
-parser.add_argument('--rnc', 
-                    metavar='R',
-                    help='Path to RNC compression runtimes. Required if using export mode 1',
-                    required=False,
-                    default=None)                        
-
-args = parser.parse_args()
-print("Save state file:", args.statefile,"\nLevel file:",args.levelfile,args.levelpath)
+#Everything in this script is split up into functions, so it can be imported and used from other Python tools as well as from Tiled
+#Example: exportLevel("C:/Tiled/Maps/test.tmx", "TS2-1.bst") does the same as running the script with those arguments
 
-fileName = args.statefile                           #Save state to read the level data from
-levelFile = args.levelfile                          #Tiled level file, the data read from the save state will be exported here
-tiledPath = args.levelpath                          #Path to the map file, as parsed from Tiled
-rncPath = args.rnc                                  #Path to RNC runtimes (export mode 1)
-
-file = open(fileName,"r+b")                         #Open the RAM export or save state from BSNES-plus, defined in fileName
 ramSize = int("FFFFFF", 16)                         #Size of SNES RAM
-stateSize = 289885                                  #Exact size of a BSNES save state, a fail safe just in case an invalid file was chosen
 romSize = 4194304                                   #Exact size of ROM, fail safe for export mode 1
-
-stateOffset = int("21C", 16)                        #Offset from 0 off save states, BSNES savestates has some data before the actual RAM so zero offset is at 21C
-objectOffset = stateOffset+int("A00", 16)           #Starting location in RAM where objects are stored
-levelOffset = stateOffset+int("4B20", 16)           #Starting location in RAM where level tiles are stored
-
-tempArray = [None] * 2304                           #Temporary array fit to full object size just to avoid running into index-out-of-range problems
-
-if (os.path.getsize(fileName) != stateSize) & (args.exportmode == '0'):
-    print("ERROR: Save state has the wrong file size. Has the correct file been chosen?")
-    file.close()
-    sys.exit()
-elif (os.path.getsize(fileName) != romSize) & (args.exportmode == '1'):
-    print("ERROR: ROM has the wrong file size. Has the correct file been chosen?")
-    file.close()
-    sys.exit()
-
-if (re.search('[^0-9]',levelFile)):                 #For exportmode 1, we need to find out which level this is, so look at the numbers in the level file.
-    lIndex = int(re.sub('[^0-9]', '', levelFile))
-    print("Found level index:",lIndex)
-elif not (re.search('[^0-9]',levelFile)) and (args.exportmode == '1'): 
-    print("ERROR: Can not find which level to export to. Level file has to be numbered after the level (0-15)")
-    file.close()
-    sys.exit()
-
-#This function converts 16-bit signed and unsigned integers into 16-bit signed integers stored in little endian (least significant byte first) 
-def intToByte(x):
-    y = 0                               #Y will be used as the high byte, and it will be calculated from the integer passed into the function
-    z = x
-    if z < 0:                           
-        z = 65536 + z                   #This converts the unsigned integer into a signed integer
-    if x > 65535:                       #Sanity check: We're only dealing with 16-bit integers
-        print("ERROR: Value is not a 16-bit value")
-        return
-    elif (x < 256) and (x >= 0):        #If x is up to 255, it will fit in a single byte (low byte), but it also has to be a positive number
-        #print("Integer to byte conversion: Value returned with a high byte of 0",x)
-        y = 0
-    else:
-        while z > 255:                  #This essentially divides the number in a safe way and puts the remainder as low byte
-            z -= 256
-            y += 1
-        #print("Integer to byte conversion: LOW byte:",z,"HIGH byte:",y)
-    if y > 255:                         #Debug: this probably is not an issue anymore
-        y = 255
-        print("WARNING! 1 byte has exceeded 255 in value and is therefor not valid. Something is wrong with the math.")
-    return z, y                         #Returns low and high byte
-
-#Level data segment, first loop finds the line start and line end point, then the file is read again to load the actual data
-with open(levelFile, "r",encoding="utf-8") as f:
-    lines = f.readlines()
-    for index, line in enumerate(lines):
-        if "<data encoding=" in line:                   #Find the start of the level data segment
-            mStart = index + 1
-            #print("".join(lines[max(0, index+1):index + 5])) 
-        if "</data>" in line:                           #Find the end of the level data segment
-            mEnd = index 
-with open(levelFile, "r",encoding="utf-8") as f:
-    lines = str(f.readlines()[mStart:mEnd])             #Read lines between start and end of level data segment as string
-    lines = lines.split(",")                            #Splits the string into a list so that every number is its own entry
-
-starAmt = 0
-blankAmt = 0
-firstTile = 0
-lastTile = 0
-firstMatch = False
-tileIndex = 0
-newList = []
-for ind in lines:                                       #There's still junk such as newline characters and spaces inside the list that has to be removed
-    und = re.sub('[^0-9]', '', ind)                     #Using regex to clear everything but numbers
-    if und == "":                                       #There may still be empty entries, so we ignore those
-        pass
-    else:
-        newList.append(int(und))                        #Add the valid numbers into our new list
-for ind in newList:    
-    if (ind == 254) or (ind == 255):                    #Stars can either be id 254 or id 255 depending on their orientation
-        starAmt += 1                                    #Calculates how many stars are located inside the map
-    elif (ind == 0):
-        blankAmt += 1                                   #Calculates how many blank tiles there are
-    if (ind == 0) and (firstMatch == False):
-        pass                                            #Do nothing if only zeroes have been found so far
-    elif (ind > 0) and (firstMatch == False):           #Looks for the first tile that isn't empty space and considers it the beginning
-        firstMatch = True                               #After this point we don't need to look for the first matched value anymore
-        firstTile = tileIndex
-    elif (ind > 0) and (firstMatch == True):            #Keep updating the last tile variable as long as the tile ID is larger than 0
-        lastTile = tileIndex                            #This way, we found out where exactly the last tile is and can use that to calculate effective level size 
-    tileIndex += 1                                      #This is just here to keep track of where we are in the loop
-tileIndex = 0
-#Diagnostics, useful data about the level
-print("--LEVEL STATISTICS--")
-print("Stars found:",starAmt,"- Blank tiles:",blankAmt,"- Non-empty tiles:",(len(newList)-blankAmt),"- Consecutive level size:",(lastTile-firstTile),"- Of which are blanks:",(lastTile-firstTile)-(len(newList)-blankAmt))
-print("First tile number:",firstTile,"- Located at:",hex(int("0x4B20",16) + firstTile),"- Value:",newList[firstTile])
-print("Last tile number:",lastTile,"- Located at:",hex(int("0x4B20",16) + lastTile),"- Value:",newList[lastTile])
-
-#This is where the level file is being read
-readLevel = open(levelFile, 'r',encoding="utf-8").readlines()
-x = 0
-y = 0
-creatureIndex = 0
-for line in readLevel:                                          #This function is here because we need to find the highest ID used in the map file
-    if str("<data encoding") in line:
-        pass
-    if str("<objectgroup") in line:
-        testus2 = re.findall('name="Creature ([^"]*)"',line)    #Only bother to set the creature index if the object in question is a creature
-        if testus2:
-            creatureIndex = int(float(testus2[0]))              #Multiple casting has to be done to get around the document format
-        else:
-            pass
-    if str("<object id=") in line:                              #Clues are stored in the name inside Tile
-        if (re.findall("01 - Position",line)):
-            testus = re.findall('x="([^"]*)"',line)
-            xPos = int(float(testus[0]))
-            testus = re.findall('y="([^"]*)"',line)
-            yPos = int(float(testus[0]))
-            lowByte,highByte = intToByte(xPos)
-            tempArray[0+((creatureIndex)*48)] = lowByte
-            tempArray[1+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(yPos)
-            tempArray[2+((creatureIndex)*48)] = lowByte
-            tempArray[3+((creatureIndex)*48)] = highByte
-        elif (re.findall("02 - Patrolling zone",line)):
-            testus = re.findall('x="([^"]*)"',line)
-            xPatrol = int(float(testus[0]))
-            testus = re.findall('y="([^"]*)"',line)
-            yPatrol = int(float(testus[0]))
-            testus = re.findall('width="([^"]*)"',line)
-            if testus:                                          #If width or height is 0, Tiled will remove the line from the map file. So if regex doesn't find the line, we know it's 0
-                wPatrol = xPatrol + int(float(testus[0]))
-            else:
-                wPatrol = 0
-            testus = re.findall('height="([^"]*)"',line)
-            if testus:
-                hPatrol = yPatrol + int(float(testus[0]))
-            else:
-                hPatrol = 0
-            lowByte,highByte = intToByte(xPatrol)
-            tempArray[4+((creatureIndex)*48)] = lowByte
-            tempArray[5+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(yPatrol)
-            tempArray[6+((creatureIndex)*48)] = lowByte
-            tempArray[7+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(wPatrol)
-            tempArray[24+((creatureIndex)*48)] = lowByte
-            tempArray[25+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(hPatrol)
-            tempArray[26+((creatureIndex)*48)] = lowByte
-            tempArray[27+((creatureIndex)*48)] = highByte
-        elif (re.findall("03 - Render zone",line)):
-            testus = re.findall('x="([^"]*)"',line)
-            xRender = int(float(testus[0]))
-            testus = re.findall('y="([^"]*)"',line)
-            yRender = int(float(testus[0]))
-            testus = re.findall('width="([^"]*)"',line)
-            if testus:
-                wRender = int(float(testus[0]))
-            else:
-                wRender = 0
-            testus = re.findall('height="([^"]*)"',line)
-            if testus:
-                hRender = int(float(testus[0]))
-            else:
-                hRender = 0
-            lowByte,highByte = intToByte(xRender)
-            tempArray[8+((creatureIndex)*48)] = lowByte
-            tempArray[9+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(yRender)
-            tempArray[10+((creatureIndex)*48)] = lowByte
-            tempArray[11+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(xRender + wRender)
-            tempArray[12+((creatureIndex)*48)] = lowByte
-            tempArray[13+((creatureIndex)*48)] = highByte
-
-            lowByte,highByte = intToByte(yRender + hRender)
-            tempArray[14+((creatureIndex)*48)] = lowByte
-            tempArray[15+((creatureIndex)*48)] = highByte
-        elif (re.findall("04 - Hitbox size",line)):
-            testus = re.findall('x="([^"]*)"',line)
-            xHitbox = int(float(testus[0]))
-            testus = re.findall('y="([^"]*)"',line)
-            yHitbox = int(float(testus[0]))
-            testus = re.findall('width="([^"]*)"',line)
-            if testus:
-                wHitbox = int(float(testus[0]))
-            else:
-                wHitbox = 0
-            testus = re.findall('height="([^"]*)"',line)
-            if testus:
-                hHitbox = int(float(testus[0]))
-            else:
-                hHitbox = 0
-            resetOffsetX = xPos - xHitbox                       #The game doesn't read the hitbox variables the same way as Tiled, so here they're converted
-            resetOffsetY = yPos + (yHitbox*-1)                  #Game reads it as offset from X-pos, while Tiled needs the hitbox to have it's own separate position
-            resetOffsetY = resetOffsetY * -1
-            lowByte,highByte = intToByte(resetOffsetX)
-            tempArray[32+((creatureIndex)*48)] = lowByte
-            tempArray[33+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(resetOffsetY)
-            tempArray[34+((creatureIndex)*48)] = lowByte
-            tempArray[35+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(wHitbox)
-            tempArray[36+((creatureIndex)*48)] = lowByte
-            tempArray[37+((creatureIndex)*48)] = highByte
-            lowByte,highByte = intToByte(hHitbox)
-            tempArray[38+((creatureIndex)*48)] = lowByte
-            tempArray[39+((creatureIndex)*48)] = highByte
-        y += 2
-    if str("<property name=") in line:
-        testus3 = re.findall('name="([^"]*).',line)
-        findIndex = re.search(r'(-?[\d]+)',testus3[0])
-        findIndex = int(float(findIndex[0])) - 1                #This simply extracts that index number to figure out exactly where to put it back in RAM
-        
-        testus2 = re.findall('value="([^"]*)"',line)
-        if testus2:
-            tempArray[findIndex+((creatureIndex)*48)] = int(float(testus2[0]))
-        else:
-            pass                                                #If no valid value was found, just ignore it. This is a sanity check and may not be required 
-    y += 1
-x += 1
-i = 0
-creatureDouble = []
-forceRead = True
-while i < len(tempArray):
-    if (tempArray[i] == None) and (forceRead == False):         #We definitely don't want to load the final byte array with "None"
-        break                                                   #Break out of the loop on the first instance of "None", at this point we know there are no more creatures to load
-    elif (tempArray[i] == None) and (forceRead == True):        #Force reading here means that the next creature instance was empty, but it will still continue with the loop
-        creatureDouble.append(0)
-    else:
-        creatureDouble.append(int(tempArray[i]))
-    i += 1
-
-arrayCreatures=bytearray(creatureDouble)
-arrayLevel=bytearray(newList)
-print("Creature amount:",creatureIndex,"\nWriting into file:",fileName,"\nFrom map file:",levelFile)
+#Object (creature) and level tile addresses in RAM are defined in savestate.py
 
 #Size of unmodified compressed levels. Compare with these values to make sure the custom level isn't too big in size
 lSize = [
@@ -323,41 +59,428 @@ lOffset = [
     0x00307431
 ]
 
-if args.exportmode == '0':
+#Creature records are 48 bytes each, the 16-bit fields come in the order of creatureEntry in state2level.py (and the bytes in the order of creatureEntryByte)
+#Field names are used without the number in front, so "01. X-pos" is the field "X-pos" at byte 0 of the record
+creatureFields = {name.split(". ", 1)[1]: index*2 for index, name in enumerate(creatureEntry)}
+creatureRecordSize = len(creatureEntryByte)
+creatureAmtMax = objectSize // creatureRecordSize
+
+#Packs a 16-bit field of a creature straight into the creature block. Negative values are stored as signed and everything else as unsigned, so -32768 to 65535 fits
+#Raises a ValueError that names the creature, field and value if it doesn't fit
+def packCreatureWord(block, creatureIndex, field, value):
+    if not (0 <= creatureIndex < creatureAmtMax):
+        raise ValueError("Creature {0} does not exist, only creatures 0-{1} fit in the level".format(creatureIndex, creatureAmtMax-1))
+    try:
+        struct.pack_into("<h" if value < 0 else "<H", block, (creatureIndex*creatureRecordSize) + creatureFields[field], value)
+    except struct.error:
+        raise ValueError("Creature {0}: {1} is {2}, which does not fit in 16 bits (-32768 to 65535)".format(creatureIndex, field, value))
+
+#Packs a single byte of a creature, byteIndex is 0-47 (the property number - 1)
+def packCreatureByte(block, creatureIndex, byteIndex, value, name):
+    if not (0 <= creatureIndex < creatureAmtMax):
+        raise ValueError("Creature {0} does not exist, only creatures 0-{1} fit in the level".format(creatureIndex, creatureAmtMax-1))
+    if not (0 <= byteIndex < creatureRecordSize):
+        raise ValueError("Creature {0}: property \"{1}\" is not one of the {2} creature bytes".format(creatureIndex, name, creatureRecordSize))
+    try:
+        struct.pack_into("<B", block, (creatureIndex*creatureRecordSize) + byteIndex, value)
+    except struct.error:
+        raise ValueError("Creature {0}: property \"{1}\" is {2}, which does not fit in a byte (0-255)".format(creatureIndex, name, value))
+
+#Reads a Tiled map file in a single streaming pass. Every tile layer and object group is handled by name and attribute as soon as it has been parsed, and thrown away right after
+#This way it doesn't matter how Tiled formats the file, and the whole map never has to be kept in memory
+#Returns the level tiles (as a NumPy array), the creature block as it's stored in RAM and the creature index of the last creature group
+def readMapFile(levelFile):
+    import xml.etree.ElementTree as ET
+    import numpy as np
+    arrayCreatures = bytearray(objectSize)              #Creature block as it's stored in RAM, bytes that aren't in the map are left as 0
+    creatureIndex = 0
+    newList = np.zeros(0, dtype=np.int64)
+    chunks = []                                         #Chunks of an infinite map, put back together once the size of the map is known
+    mapWidth = 0
+    mapHeight = 0
+    xPos = 0
+    yPos = 0
+    for event, elem in ET.iterparse(levelFile, events=("end",)):
+        if elem.tag == "data":
+            encoding = elem.get("encoding")             #Chunks are stored with the encoding and compression of the <data> element
+            compression = elem.get("compression")
+            chunks = []
+            for chunk in elem.findall("chunk"):         #Infinite map, every chunk is encoded on its own and chunks with only empty tiles are left out
+                tileGids = [int(tile.get("gid", 0)) for tile in chunk.findall("tile")]
+                if not tileGids:
+                    tileGids = decodeLayer(chunk.text or "", encoding, compression)
+                chunks.append((int(chunk.get("x")), int(chunk.get("y")), int(chunk.get("width")), int(chunk.get("height")), tileGids))
+            tileGids = [int(tile.get("gid", 0)) for tile in elem.findall("tile")]     #Tiles stored as <tile> elements instead of CSV or base64
+            if tileGids:
+                newList = np.array(tileGids, dtype=np.int64)
+            elif not chunks:
+                newList = decodeLayerArray(elem.text or "", encoding, compression)    #CSV or base64, see tiledlayer.py
+            elem.clear()
+        elif elem.tag == "objectgroup":
+            groupName = re.match("Creature (.*)$", elem.get("name", ""))   #Only bother with the group if it's a creature, everything in there belongs to that creature
+            if groupName != None:
+                creatureIndex = int(float(groupName.group(1)))              #Multiple casting has to be done to get around the document format
+                for child in elem.iter():
+                    if child.tag == "object":
+                        name = child.get("name", "")
+                        xObject = int(float(child.get("x", 0)))
+                        yObject = int(float(child.get("y", 0)))
+                        if "01 - Position" in name:
+                            xPos = xObject
+                            yPos = yObject
+                            packCreatureWord(arrayCreatures, creatureIndex, "X-pos", xPos)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Y-pos", yPos)
+                        elif "02 - Patrolling zone" in name:
+                            xPatrol = xObject
+                            yPatrol = yObject
+                            #If width or height is 0, Tiled will remove the attribute from the map file. So if it's missing, we know it's 0
+                            wPatrol = (xPatrol + int(float(child.get("width")))) if child.get("width") != None else 0
+                            hPatrol = (yPatrol + int(float(child.get("height")))) if child.get("height") != None else 0
+                            packCreatureWord(arrayCreatures, creatureIndex, "X-start", xPatrol)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Y-start", yPatrol)
+                            packCreatureWord(arrayCreatures, creatureIndex, "X-end", wPatrol)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Y-end", hPatrol)
+                        elif "03 - Render zone" in name:
+                            xRender = xObject
+                            yRender = yObject
+                            wRender = int(float(child.get("width", 0)))
+                            hRender = int(float(child.get("height", 0)))
+                            packCreatureWord(arrayCreatures, creatureIndex, "Render X-start", xRender)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Render Y-start", yRender)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Render X-end", xRender + wRender)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Render Y-end", yRender + hRender)
+                        elif "04 - Hitbox size" in name:
+                            wHitbox = int(float(child.get("width", 0)))
+                            hHitbox = int(float(child.get("height", 0)))
+                            resetOffsetX = xPos - xObject                       #The game doesn't read the hitbox variables the same way as Tiled, so here they're converted
+                            resetOffsetY = yPos + (yObject*-1)                  #Game reads it as offset from X-pos, while Tiled needs the hitbox to have it's own separate position
+                            resetOffsetY = resetOffsetY * -1
+                            packCreatureWord(arrayCreatures, creatureIndex, "Hitbox X-offset", resetOffsetX)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Hitbox Y-offset", resetOffsetY)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Hitbox X-size", wHitbox)
+                            packCreatureWord(arrayCreatures, creatureIndex, "Hitbox Y-size", hHitbox)
+                    elif child.tag == "property":
+                        findIndex = re.search(r'(-?[\d]+)', child.get("name", ""))
+                        value = child.get("value")
+                        if (findIndex != None) and (value != None):        #If no valid index or value was found, just ignore it
+                            findIndex = int(float(findIndex[0])) - 1        #This simply extracts that index number to figure out exactly where to put it back in RAM
+                            packCreatureByte(arrayCreatures, creatureIndex, findIndex, int(float(value)), child.get("name"))
+            elem.clear()
+        elif elem.tag in ("layer", "tileset"):
+            elem.clear()
+        elif elem.tag == "map":                         #Map size is needed to put the chunks of an infinite map back together
+            mapWidth = int(elem.get("width", 0))
+            mapHeight = int(elem.get("height", 0))
+    if chunks:
+        newList = np.frombuffer(joinChunks(chunks, mapWidth, mapHeight), dtype=np.uint8).astype(np.int64)
+    return newList, arrayCreatures, creatureIndex
+
+#Prints some useful diagnostics about the level, everything is counted on the whole array at once
+def printLevelStats(newList):
+    import numpy as np
+    level = np.asarray(newList)
+    starAmt = int(np.count_nonzero((level == 254) | (level == 255)))     #Stars can either be id 254 or id 255 depending on their orientation
+    blankAmt = int(np.count_nonzero(level == 0))                        #Calculates how many blank tiles there are
+    usedTiles = np.flatnonzero(level > 0)
+    firstTile = 0                                   #The first tile that isn't empty space is considered the beginning
+    lastTile = 0                                    #The last tile that isn't empty space (after the first one) is the end, it's used to calculate effective level size
+    if len(usedTiles) > 0:
+        firstTile = int(usedTiles[0])
+    if len(usedTiles) > 1:
+        lastTile = int(usedTiles[-1])
+    #Diagnostics, useful data about the level
+    print("--LEVEL STATISTICS--")
+    print("Stars found:",starAmt,"- Blank tiles:",blankAmt,"- Non-empty tiles:",(len(level)-blankAmt),"- Consecutive level size:",(lastTile-firstTile),"- Of which are blanks:",(lastTile-firstTile)-(len(level)-blankAmt))
+    print("First tile number:",firstTile,"- Located at:",hex(int("0x4B20",16) + firstTile),"- Value:",int(level[firstTile]))
+    print("Last tile number:",lastTile,"- Located at:",hex(int("0x4B20",16) + lastTile),"- Value:",int(level[lastTile]))
+
+#Checks that every tile fits in a level byte. The first tile in the tileset is gid 1, so gids line up with the tile values in the level
+#Gid 256 is the last tile of the 16x16 tileset, which is the invalid tile 256 that can't be stored in the level. Returns False if anything is out of range
+def checkLevelData(newList):
+    import numpy as np
+    level = np.asarray(newList)
+    valid = True
+    for badTiles, message in [
+            (level == 256, "tiles use gid 256, the last tile of the tileset. Tile 256 is invalid and can not be stored in the level"),
+            (level > 256, "tiles use gids above 256, which are not part of the level tileset (flipped or rotated tiles are not supported)"),
+            (level < 0, "tiles have negative values")]:
+        badIndex = np.flatnonzero(badTiles)
+        if len(badIndex) > 0:
+            print("ERROR:",len(badIndex),message,"- First at tile number:",int(badIndex[0]),"- Located at:",hex(int("0x4B20",16) + int(badIndex[0])),"- Value:",int(level[badIndex[0]]))
+            valid = False
+    return valid
+
+#Writes the creatures and level tiles into a save state, only the bytes that are different from what's already in the save state are written
+#With atomic, the save state is written to a temporary file that is then renamed over the save state, so it can never end up half-written
+def writeState(fileName, arrayCreatures, arrayLevel, atomic=False):
     print("\n--Export mode selected: 0 (default, save state)\n")
-    file.seek(objectOffset, 0)                                  #Seek to offset where the objects are located before data is written to
-    file.write(arrayCreatures)
-    file.seek(levelOffset, 0)                                   #Seek to offset where the level tiles are located before data is written to
-    file.write(arrayLevel)
-    file.close()
-elif args.exportmode == '1':
-    if rncPath == None:
-        print("ERROR: No path was specified for RNC runtimes!")
-        file.close()
-        sys.exit()
-    if lOffset[lIndex] == None:                                 #Really Inside (3D level, self-explanatory) and The Claw (unknown as of know)
-        print("ERROR: Level not supported.")
-        file.close()
-        sys.exit()
-    if (lIndex < 0) or (lIndex > 16):
-        print("ERROR: Invalid level index!")
-        sys.exit()
+    state = SaveState(fileName, writable=True)
+    creaturesChanged = state.update(objectAddress, arrayCreatures)     #Objects and level tiles go straight to their addresses in RAM
+    levelChanged = state.update(levelAddress, arrayLevel)
+    rangeAmt = state.commit(atomic)
+    if rangeAmt == 0:
+        print("Nothing has changed, the save state was not written to")
+    elif atomic:                                    #The ranges don't matter here, the whole file is written
+        print("Bytes changed:",creaturesChanged+levelChanged,"- Creatures:",creaturesChanged,"- Level tiles:",levelChanged,"- Whole save state replaced (atomic)")
+    else:
+        print("Bytes changed:",creaturesChanged+levelChanged,"- Creatures:",creaturesChanged,"- Level tiles:",levelChanged,"- Written as",rangeAmt,"ranges")
+
+#Compresses the level tiles with rnc.py and writes them into the ROM at lOffset[lIndex], the level index has to be checked before this is called
+#Harder settings are only tried if the level doesn't fit in lSize[lIndex]. rncPath is no longer used and only kept so older callers still work
+def writeRom(fileName, arrayLevel, lIndex, rncPath=None):
+    import mmap                                 #Only needed for export mode 1
+    import rnc
     print("\n--Export mode selected: 1 (ROM)\n")
-    binOut = open("TS_UNCOMPRESSED.bin","w+b")
-    binOut.write(arrayLevel)
-    binOut.close()
-    subprocess.run([rncPath, "p", "TS_UNCOMPRESSED.bin", "TS_COMPRESSED.bin"])
-    packLvl = open("TS_COMPRESSED.bin","r+b")
-    packSize = os.path.getsize("TS_COMPRESSED.bin")
-    print("Size of compressed level:",packSize)
+    arrayPack, effort = rnc.packToFit(arrayLevel, lSize[lIndex]-1)
+    packSize = len(arrayPack)
+    print("Size of compressed level:",packSize,"- Packed with settings",effort,"of",len(rnc.packSettings)-1,"- Bytes left:",lSize[lIndex]-packSize)
     if packSize >= lSize[lIndex]:                #The ROM file uses fixed offsets, so the level can't be larger than that of the original game
         print("ERROR: Size of compressed level is too big!")
-        file.close
+        return False
+    if rnc.unpack(arrayPack) != bytes(arrayLevel):     #Never write a level that doesn't unpack to the same tiles
+        print("ERROR: Compressed level does not unpack to the same tiles, the ROM was not written to")
+        return False
+    with open(fileName, "r+b") as file:         #Open the ROM file, defined in fileName
+        with mmap.mmap(file.fileno(), 0) as rom:
+            try:
+                rnc.readHeader(rom, lOffset[lIndex])    #Make sure there is a packed level where it's about to be overwritten
+            except ValueError as error:
+                print("ERROR:", error, "- Is this the right ROM?")
+                return False
+            rom[lOffset[lIndex]:lOffset[lIndex]+packSize] = arrayPack       #Only the packed level is written, straight into the ROM file
+    return True
+
+#Exports one Tiled map file to a save state (exportmode '0') or ROM (exportmode '1')
+#In export mode 1, the level index has to be given so the level ends up in the right place in ROM
+def exportLevel(levelFile, fileName, exportmode='0', rncPath=None, lIndex=None, atomic=False):
+    try:
+        newList, arrayCreatures, creatureIndex = readMapFile(levelFile)
+    except (ValueError, SyntaxError) as error:      #Tile layer or creature values could not be read (see tiledlayer.py and packCreatureWord) or the file is not valid XML
+        print("ERROR:",error)
+        return False
+    printLevelStats(newList)
+    if not checkLevelData(newList):
+        return False
+    arrayLevel=bytearray(newList.astype("uint8").tobytes())
+    print("Creature amount:",creatureIndex,"\nWriting into file:",fileName,"\nFrom map file:",levelFile)
+    if exportmode == '0':
+        writeState(fileName, arrayCreatures, arrayLevel, atomic)
+    elif exportmode == '1':
+        return writeRom(fileName, arrayLevel, lIndex, rncPath)
+    else:
+        print("ERROR: Invalid export mode!",exportmode,exportmode)
+
+#Finds the maps for buildRom, either every .tmx file in a folder or every line of a manifest file (paths relative to the manifest, lines starting with # are skipped)
+#The level index is the number at the start of the file name, such as "0 - That Old Army Game.tmx". Returns a list of (lIndex, map file), or None if a map can't be used
+def findMapFiles(source):
+    if os.path.isdir(source):
+        levelFiles = [os.path.join(source, i) for i in sorted(os.listdir(source)) if i.lower().endswith(".tmx")]
+    else:
+        with open(source, "r") as manifest:
+            levelFiles = [os.path.join(os.path.dirname(source), i.strip()) for i in manifest if (i.strip() != "") and not i.strip().startswith("#")]
+    jobs = []
+    found = {}
+    for levelFile in levelFiles:
+        number = re.match('[0-9]+', os.path.basename(levelFile))
+        if number == None:
+            if os.path.isdir(source):                   #Other maps in the folder are left alone, but every map in a manifest has to be used
+                print("WARNING: Skipping",levelFile,"- the file name does not start with a level index")
+                continue
+            print("ERROR: Can not find which level",levelFile,"is. The file name has to start with the level index (0-16)")
+            return None
+        lIndex = int(number.group(0))
+        if (lIndex > 16) or (lOffset[lIndex] == None):
+            print("ERROR: Level",lIndex,"of",levelFile,"is not supported")
+            return None
+        if lIndex in found:
+            print("ERROR: Level",lIndex,"is in both",found[lIndex],"and",levelFile)
+            return None
+        found[lIndex] = levelFile
+        jobs.append((lIndex, levelFile))
+    return sorted(jobs)
+
+#Reads and packs one map for buildRom, which runs this in a separate process for every map. job is (lIndex, map file)
+#Returns (lIndex, map file, packed level or None if it can't be used, packing settings, seconds, console output)
+def packMapFile(job):
+    import contextlib
+    import io
+    import time
+    import rnc
+    lIndex, levelFile = job
+    start = time.perf_counter()
+    arrayPack = None
+    effort = None
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):            #Printed by buildRom once every map is done, so the output of the processes isn't mixed together
+        try:
+            newList, arrayCreatures, creatureIndex = readMapFile(levelFile)
+            if checkLevelData(newList):
+                arrayLevel = newList.astype("uint8").tobytes()
+                arrayPack, effort = rnc.packToFit(arrayLevel, lSize[lIndex]-1)
+                if rnc.unpack(arrayPack) != arrayLevel:
+                    print("ERROR: Compressed level does not unpack to the same tiles")
+                    arrayPack = None
+        except (ValueError, SyntaxError, OSError) as error:
+            print("ERROR:",error)
+    return lIndex, levelFile, arrayPack, effort, time.perf_counter() - start, output.getvalue()
+
+#Packs every map from a folder or manifest (see findMapFiles) into the ROM fileName, the maps are read and packed in parallel by a pool of processes
+#Nothing is written unless every level fits in its lSize. The levels are then patched into a copy-on-write map of the ROM,
+#which is written to outFile (fileName if not given) in one go through a temporary file, so the ROM is never left half-built
+#Returns True if the ROM was written
+def buildRom(fileName, source, outFile=None, workers=None):
+    import concurrent.futures
+    import mmap
+    import shutil
+    import tempfile
+    import time
+    import rnc
+    if outFile == None:
+        outFile = fileName
+    jobs = findMapFiles(source)
+    if jobs == None:
+        return False
+    if len(jobs) == 0:
+        print("ERROR: No maps found in",source)
+        return False
+    print("\n--Building ROM from",len(jobs),"maps\n")
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(packMapFile, jobs))
+    print("{0:>5}  {1:<40}{2:>8}{3:>8}{4:>8}{5:>10}{6:>11}".format("Level", "Map file", "Packed", "Budget", "Left", "Settings", "Time (ms)"))
+    failed = 0
+    for lIndex, levelFile, arrayPack, effort, elapsed, output in results:
+        if arrayPack == None:
+            print("{0:>5}  {1:<40}".format(lIndex, os.path.basename(levelFile)))
+            print(output.rstrip())
+            failed += 1
+            continue
+        print("{0:>5}  {1:<40}{2:>8}{3:>8}{4:>8}{5:>10}{6:>11.1f}".format(lIndex, os.path.basename(levelFile), len(arrayPack), lSize[lIndex], lSize[lIndex]-len(arrayPack), effort, elapsed*1000))
+        if len(arrayPack) >= lSize[lIndex]:             #Same check as writeRom, the ROM file uses fixed offsets
+            print("       ERROR: Size of compressed level is too big!")
+            failed += 1
+    if failed > 0:
+        print("\nERROR:",failed,"of",len(jobs),"levels can't be used, the ROM was not written to")
+        return False
+    with open(fileName, "rb") as romFile:
+        with mmap.mmap(romFile.fileno(), 0, access=mmap.ACCESS_COPY) as rom:  #Changes only end up in memory, the ROM file itself is left alone
+            for lIndex, levelFile, arrayPack, effort, elapsed, output in results:
+                try:
+                    rnc.readHeader(rom, lOffset[lIndex])        #Make sure there is a packed level where it's about to be overwritten
+                except ValueError as error:
+                    print("\nERROR:", error, "- Is this the right ROM? The ROM was not written to")
+                    return False
+            for lIndex, levelFile, arrayPack, effort, elapsed, output in results:
+                rom[lOffset[lIndex]:lOffset[lIndex]+len(arrayPack)] = arrayPack
+            handle, tempName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(outFile)), suffix=".tmp")
+            try:
+                with os.fdopen(handle, "wb") as f:
+                    f.write(rom)
+                    f.flush()
+                    os.fsync(f.fileno())                #Make sure the data is on disk before the rename makes it the ROM
+            except BaseException:
+                os.remove(tempName)
+                raise
+    try:
+        shutil.copymode(fileName, tempName)
+        os.replace(tempName, outFile)
+    except BaseException:
+        os.remove(tempName)
+        raise
+    print("\nWrote",len(results),"levels into",outFile,"in {0:.0f} ms".format((time.perf_counter()-start)*1000))
+    return True
+
+if __name__ == "__main__":
+    #Argument parser function
+    parser = argparse.ArgumentParser(
+                        prog='Level2State',
+                        description='Toy Story SNES Level Importer - Read a Tiled map and export it into a BSNES save state.',
+                        epilog='Usage: level2state INPUT OUTPUT MAPPATH')
+                    
+
+    parser.add_argument('levelfile', 
+                        metavar='L',
+                        nargs='?',
+                        help='Tiled level file to read from (.tmx)')
+                        #Tiled supports parsing the filename that it is currently editing into this script as %mapfile
+    parser.add_argument('statefile', 
+                        metavar='S',
+                        help='BSNES save state file to export to (.bst). ROM file if in mode 1')                     
+                        #The path to the save state has to be provided in full inside the command string
+    parser.add_argument('levelpath', 
+                        metavar='P',
+                        nargs='?',
+                        help='Directory path to where the map is located') 
+                        #This can be sent directly from a Tiled variable called %mappath
+    parser.add_argument('--exportmode', 
+                        metavar='M',
+                        help='Export mode (0-1). 0 if exporting to save state, 1 if exporting to ROM',
+                        required=False,
+                        default='0')
+    parser.add_argument('--rnc', 
+                        metavar='R',
+                        help='No longer needed, ROM levels are packed by rnc.py. Kept so older Tiled commands still work',
+                        required=False,
+                        default=None)                        
+    parser.add_argument('--atomic', 
+                        action='store_true',
+                        help='Write the save state to a temporary file and rename it into place, so it is never left half-written')
+    parser.add_argument('--build', 
+                        metavar='D',
+                        help='Pack every map in the folder D (or listed in the manifest file D) into the ROM given as the save state, the map file and path are not needed then',
+                        required=False,
+                        default=None)
+    parser.add_argument('--output', 
+                        metavar='O',
+                        help='ROM file written by --build, the ROM itself is replaced if left out',
+                        required=False,
+                        default=None)
+    parser.add_argument('--workers', 
+                        metavar='W',
+                        type=int,
+                        help='Amount of processes used with --build (all CPU cores by default)',
+                        required=False,
+                        default=None)
+
+    args = parser.parse_args()
+    if args.build != None:                              #Batch build of a ROM from many maps
+        if os.path.getsize(args.statefile) != romSize:
+            print("ERROR: ROM has the wrong file size. Has the correct file been chosen?")
+            sys.exit()
+        if not buildRom(args.statefile, args.build, args.output, args.workers):
+            sys.exit(1)
+        sys.exit()
+
+    if (args.levelfile == None) or (args.levelpath == None):
+        parser.error("the following arguments are required: L, P (or use --build)")
+    print("Save state file:", args.statefile,"\nLevel file:",args.levelfile,args.levelpath)
+
+    fileName = args.statefile                           #Save state to read the level data from
+    levelFile = args.levelfile                          #Tiled level file, the data read from the save state will be exported here
+    tiledPath = args.levelpath                          #Path to the map file, as parsed from Tiled
+    rncPath = args.rnc                                  #Path to RNC runtimes (no longer used, see rnc.py)
+    lIndex = None
+
+    if (os.path.getsize(fileName) != stateSize) & (args.exportmode == '0'):
+        print("ERROR: Save state has the wrong file size. Has the correct file been chosen?")
         sys.exit()
-    arrayPack = packLvl.read()
-    file.seek(lOffset[lIndex],0)            
-    file.write(arrayPack)
-    file.close()
-else:
-    print("ERROR: Invalid export mode!",args.exportmode,args.exportmode)
-    file.close()
+    elif (os.path.getsize(fileName) != romSize) & (args.exportmode == '1'):
+        print("ERROR: ROM has the wrong file size. Has the correct file been chosen?")
+        sys.exit()
+
+    if (re.search('[^0-9]',levelFile)):                 #For exportmode 1, we need to find out which level this is, so look at the numbers in the level file.
+        lIndex = int(re.sub('[^0-9]', '', levelFile))
+        print("Found level index:",lIndex)
+    elif not (re.search('[^0-9]',levelFile)) and (args.exportmode == '1'): 
+        print("ERROR: Can not find which level to export to. Level file has to be numbered after the level (0-15)")
+        sys.exit()
+
+    if args.exportmode == '1':
+        if (lIndex < 0) or (lIndex > 16):
+            print("ERROR: Invalid level index!")
+            sys.exit()
+        if lOffset[lIndex] == None:                                 #Really Inside (3D level, self-explanatory) and The Claw (unknown as of know)
+            print("ERROR: Level not supported.")
+            sys.exit()
+
+    exportLevel(levelFile, fileName, args.exportmode, rncPath, lIndex, args.atomic)
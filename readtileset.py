@@ -2,81 +2,24 @@
 #This script reads the full tilemap from the VRAM section of a BSNES-plus save state and exports it into a PNG
 #Intended to be used for SNES Toy Story but could potentially be used for other games as well if the tilemap address is adjusted accordingly
 
-import cv2
-import numpy as np
 import argparse
-import subprocess
 import sys
 import os
 import re
+import struct
+import zlib
+import functools
+import concurrent.futures
+from savestate import SaveState, stateSize
+
+#NumPy and OpenCV are slow to import, so they are imported inside the functions that use them instead of up here
+#That way, the command line errors show up right away and other tools can import this script without paying for them
+#OpenCV is only needed when saving the tileset as an RGB image (--rgb), the default indexed PNG is written by encodeIndexedPNG
 
-parser = argparse.ArgumentParser(
-                    prog='Readtileset',
-                    description='Toy Story SNES Tileset Exporter - Read a BSNES-Plus or other SNES emulator save state and export the tilemap to Tiled.',
-                    epilog='Usage: readtileset state levelfile --tileset --importmode --rnc')
-
-parser.add_argument('statefile', 
-                    metavar='S',
-                    help='BSNES save state file to read from (.bst). ROM file if in mode 1')    
-parser.add_argument('--levelfile', 
-                    metavar='L',
-                    required=False,
-                    help='Tiled level file to read from (.tmx)')                    
-parser.add_argument('--tileset', 
-                    metavar='T',
-                    help='Saves the tileset at the user specified location')
-parser.add_argument('--importmode', 
-                    metavar='I',
-                    help='Import mode (0-1). 0 if importing from a save state, 1 if importing directly from ROM',
-                    required=False,
-                    default='0')
-parser.add_argument('--rnc', 
-                    metavar='R',
-                    help='Path to RNC compression runtimes. Required if using export mode 1',
-                    required=False,
-                    default=None)   
-
-args = parser.parse_args()
-print("Save state file:", args.statefile,"\nTileset path:",args.tileset)
-
-levelFile = args.levelfile
-fileName = args.statefile                           #Save state to read the level data from
-tilesetPath = args.tileset                          #The user can specify a custom tileset path
-file = open(fileName,"r+b")                         #Points to the RAM dump or save state we want to load from in binary write mode
-stateSize = 289885                                  #Exact size of a BSNES save state, a fail safe just in case an invalid file was chosen
 romSize = 4194304                                   #Exact size of ROM, fail safe for import mode 1
+vram2Address = int("18000", 16)                     #Complete unpacked VRAM of the level (no parallax), stored in WRAM with the same layout as VRAM
+exampleTileID = int("1A0", 16)                      #Locates the specific tile inside VRAM
 
-stateOffset = int("21C", 16)                        #Offset from 0 off save states, when used with a BSNES RAM dump this should be just 0
-tilemapOffset = stateOffset+int("2B20", 16)         #Starting tile in the tilemap
-vramOffset = stateOffset+int("30000", 16)           #VRAM starting address in save state
-vram2Offset = stateOffset+int("18000", 16)
-cgramOffset = stateOffset+int("40220", 16)
-levelIndex = stateOffset+int("1A", 16)              #Level index
-
-exampleTileID = vramOffset+int("1A0", 16)           #Locates the specific tile inside VRAM
-
-if (args.importmode == '1'):                        #Coming soon, need to figure out ROM addresses for the RNC packets before this can be implemented
-    print("Importing from ROM file is not yet supported with this script.")
-    file.close
-    sys.exit()
-if (os.path.getsize(fileName) != stateSize) and (args.importmode == '0'):
-    print("ERROR: Save state has the wrong file size. Has the correct file been chosen?")
-    file.close()
-    sys.exit()
-if ((os.path.getsize(fileName) != romSize) and (args.importmode == '1')):
-    print("ERROR: ROM has the wrong file size. Has the correct file been chosen?")
-    file.close()
-    sys.exit()
-if levelFile != None:
-    if (re.search('[^0-9]',levelFile)) and not ((levelFile != "%mapfile") or (levelFile != None)):       
-        lIndex = int(re.sub('[^0-9]', '', levelFile))
-        print("Found level index:",lIndex)
-    elif not (re.search('[^0-9]',levelFile)) and (args.importmode == '1'): 
-        print("ERROR: Can not find which level to import from. Create a level file with a number (0-15) and then try again")
-        file.close()
-        sys.exit()
-    elif not ((re.search('[^0-9]',levelFile)) or levelFile == "%mapfile") and (args.importmode == '0'):
-        print("No map file is loaded.")
 
 lName = [
     "That Old Army Game",
@@ -167,6 +110,33 @@ def drawChar(tilepart):                                         #Character is th
         z += 1
     return partTile
 
+#Vectorized version of drawChar, decodes any amount of 32-byte characters at once and returns them as an (amount, 8, 8) array of color indices
+#splitPlane, compositePlanes and drawChar are kept as the reference implementation, the output of both is identical
+def decodeChars(charBytes):
+    import numpy as np
+    planes = np.frombuffer(charBytes, dtype=np.uint8).reshape(-1, 2, 8, 2)  #Character, plane pair (byte 0-15 or 16-31), row, plane within the pair
+    bits = np.unpackbits(planes[..., np.newaxis], axis=-1)                  #Same as splitPlane: highest bit first, so index 0 is the leftmost pixel
+    chars = bits[:, 0, :, 0] | (bits[:, 0, :, 1] << 1)                      #Same as compositePlanes: plane 0 and 1 come from the first 16 bytes
+    chars |= (bits[:, 1, :, 0] << 2) | (bits[:, 1, :, 1] << 3)              #Plane 2 and 3 come from the last 16 bytes
+    return chars
+
+#Decodes every character the tilemap can point at (10-bit address = 1024 characters) in one go, so drawFullTile only has to look them up
+#If a list of character addresses is given (see usedChars), only those are decoded and the rest of the table is left blank
+def readCharTable(state, charAddresses=None):
+    import numpy as np
+    if charAddresses is None:
+        return decodeChars(state.vram[:1024*32])
+    charTable = np.zeros((1024, 8, 8), dtype=np.uint8)
+    charBytes = np.frombuffer(state.vram[:1024*32], dtype=np.uint8).reshape(1024, 32)
+    charTable[charAddresses] = decodeChars(charBytes[charAddresses].tobytes())
+    return charTable
+
+#Character addresses (the 10-bit VRAM address of every 16-bit tilemap entry) used by the given tile values, without duplicates
+def usedChars(state, tileValues):
+    import numpy as np
+    tilemap = np.frombuffer(state.tilemap, dtype="<u2")[:(len(state.tilemap)//32)*16].reshape(-1, 16)   #16 little endian entries per tile
+    return np.unique(tilemap[tileValues] & 1023)
+
 def splitColorByte(Byte):                                       #SNES reads colors from a palette stored in CGRAM, which in turn is BGR555
     colTest = Byte                                              #5 bits for each color (0-31), with the highest bit being unused
     colB = (colTest & 31744) >> 10                              #To sort out these colors, the bits that we want can be shifted out
@@ -180,22 +150,80 @@ def byteToIntList(wordList):
         byteList.append((wordList[i+1])+(256*wordList[i]))
     return byteList
 
-def drawFullTile(tileIndex):
-    colorTable = []
+#Decodes all 8 palettes from color graphics RAM into one 128-entry BGR888 table, this only has to be done once per save state
+#The table can then be shared by every drawFullTile call, so coloring a pixel is a single lookup with the color index + (palette * 16)
+def readPalette(state):
+    import numpy as np
+    colors = np.frombuffer(state.cgram[:8*32], dtype='<u2')     #128 BGR555 colors stored in little endian
+    palette = np.empty((128, 3), dtype=np.uint16)
+    palette[:, 0] = (colors & 31744) >> 10                      #Same bit masks as splitColorByte
+    palette[:, 1] = (colors & 992) >> 5
+    palette[:, 2] = (colors & 31)
+    palette = ((palette * 255) // 31).astype(np.uint8)          #Convert from color space BGR555 to BGR888
+    palette[::16] = 1                                           #For SNES, color 0 of every palette is transparent, so it gets the chroma key 0x010101
+    return palette                                              #A "real" color can never be 1, the darkest pixel is 8, therefor, chroma key can safely be set to 1
+
+#Works like the palette table, but instead of colors it gives the index of the color in an indexed PNG (color + palette * 16)
+#Color 0 of every palette is transparent, so they all get index 0 which is the only transparent entry in the PNG
+def readIndexTable():
+    import numpy as np
+    indexTable = np.arange(128, dtype=np.uint8).reshape(128, 1)
+    indexTable[::16] = 0
+    return indexTable
+
+#Level tiles reuse the same characters all the time, often mirrored, so every colored character is only built once and then kept here
+#Characters are keyed by their 10-bit VRAM address, 3-bit palette and the H/V mirror flags, exactly the bits that decide what the 8x8 pixels look like
+#Mirrored characters are made from a copy of the unmirrored one. Returned characters are shared between lookups and should not be modified
+class CharCache:
+    def __init__(self, charTable, palette):
+        self.charTable = charTable                              #Decoded characters, see readCharTable
+        self.palette = palette                                  #Palette table, see readPalette
+        self.chars = {}
+        self.hits = 0
+        self.misses = 0
+
+    def getChar(self, tileAdr, tilePal, hMirror, vMirror):
+        key = (tileAdr, tilePal, hMirror, vMirror)
+        char = self.chars.get(key)
+        if char is not None:
+            self.hits += 1
+            return char
+        self.misses += 1
+        if hMirror or vMirror:
+            char = self.chars.get((tileAdr, tilePal, False, False))
+            if char is None:                                    #The unmirrored character is cached as well, since it is likely to be used on its own too
+                char = self.palette[self.charTable[tileAdr]+(tilePal*16)]
+                self.chars[(tileAdr, tilePal, False, False)] = char
+            if hMirror:
+                char = char[:, ::-1]                            #Reverse every row if H-flag is on
+            if vMirror:
+                char = char[::-1]                               #For v-flag, the order of the rows themselves are flipped
+            char = char.copy()
+        else:
+            char = self.palette[self.charTable[tileAdr]+(tilePal*16)]   #Color every pixel of the character from the palette table
+        self.chars[key] = char
+        return char
+
+    def printStats(self):
+        lookups = self.hits + self.misses
+        if lookups > 0:
+            print("Character cache:",self.hits,"hits,",self.misses,"misses -","{0:.1f}%".format(100*self.hits/lookups),"of",lookups,"character lookups reused")
+
+#Builds one full 32x32 tile (4x4 characters) and returns it as a (32, 32, 3) BGR array, or (32, 32, 1) color indices when drawn with readIndexTable
+def drawFullTile(state, tileIndex, charCache):
+    import numpy as np
     currentTile = tileIndex * 32                                #Each full tile consists of 32 bytes
-    file.seek(tilemapOffset+currentTile, 0)
     fullTile = []
-    fullTile = list(file.read(32))
+    fullTile = list(state.tilemap[currentTile:currentTile+32])
     fullTile = swapEndian(fullTile)
-    file.seek(cgramOffset, 0)
-    colTable = list(file.read(8*32))                            #Read all possible palettes from color graphics RAM
-    colTable = swapEndian(colTable)
-    colTableByte = byteToIntList(colTable)                      #Put the two big endian bytes together to make the math a bit easier to keep track of
+    #Characters are read from VRAM in 8x8 segments, in rows of 4 characters
+    #The tile is allocated as a 32x32 image, but viewed as (character row, pixel row, character column, pixel column, color)
+    #so that each character can be placed straight into its spot without having to rearrange any rows afterwards
+    channels = charCache.palette.shape[1]
+    fullTileImage = np.empty((32, 32, channels), dtype=np.uint8)
+    charGrid = fullTileImage.reshape(4, 8, 4, 8, channels)
     x = 0
-    y = 0
-    z = 0
     tileAdr = 0
-    partTileRow = []
     while x < 16:
         tileAdr = fullTile[(x*2)+1]+(fullTile[x*2]*256)         #Need to read 10 bits from both of these bytes, so combine them first
         tilePal = tileAdr & 7168                                #AND with 3 bits to get palette
@@ -204,142 +232,328 @@ def drawFullTile(tileIndex):
         tilePri = tileAdr & 8192                                #Priority flag
         tilePal = tilePal >> 10                                 #Shift bits down as we don't want the padding
         tileAdr = tileAdr & 1023                                #AND only with the first 10 bytes
-        file.seek(vramOffset+(tileAdr*32), 0)                   #From tilemap, find tile segment in VRAM
-        numberLE = list(file.read(32))                          #Read the full tile
-        numberBE = swapEndian(numberLE)                         #Swap from little to big endian
-        #if tileIndex == 1 and x == 2:
-        #    for i in numberLE:
-        #        print(hex(i))
-        #        pass
-        #    print(hex(tileAdr))
-        #    sys.exit()
-        partTile = drawChar(numberLE)                           #The key function that triggers the chain of reading pixel data all the way down
-        if hMirror != 0:
-            for idx,i in enumerate(partTile):
-                partTile[idx] = list(reversed(partTile[idx]))   #Iterate through tile and reverse every row if H-flag is on
-        if vMirror != 0:
-            if sum(sum(x) for x in partTile) > 0:               #For v-flag, the order of the list entries themselves are flipped
-                partTile = list(reversed(partTile))
-        for i in partTile:
-            for m in i:    
-                if m == 0:                                      #Set transparent tiles to a very specific number so that the sheet can be chroma-keyed
-                    B,G,R = 1,1,1                               #For SNES, color 0 is always transparent, and from the color space conversion a "real"    
-                else:                                           #color can never be 1, the darkest pixel is 8, therefor, chroma key can safely be set to 1
-                    B,G,R = splitColorByte(colTableByte[m+(tilePal*16)])
-                    B = int((B * 255) / 31)                     #Convert from color space BGR555 to BGR888
-                    G = int((G * 255) / 31)
-                    R = int((R * 255) / 31)
-                colorTable.append((B,G,R))                      #BGR can be converted to RGB here if needed by changing the append order
-        x += 1  
-    x = 0
-    y = 0
-    z = 0
-    a = 0
-    #From partTileRow: A full tile is read, but the data is in the wrong format because it's read from VRAM in 8x8 segments
-    #Because of this, the result of partTileRow will be a giant column that is 8 pixels wide, 256 pixels tall, totalling 32 pieces of 8x8 tiles in one dimension
-    #Most of the relevant image/picture functions require a 2D-array to define the horizontal and vertical size of the constructed tile
-    #The following nested loop in the x-axis reads one 8-pixel row per 8x8 tile, for four consecutive tiles, and places the rows in order of 4, so we get 8x4=32
-    #This is done 8 times (y-axis) which produces the first part of the tile which becomes 32x8
-    #This is then done 4 times in total to properly read off the column of 32 segments of 8x8 tiles.
-    tempRow = []
-    colorTable2 = []
-    while z < 4:
-        while y < 8:
-            while x < 4:
-                while a < 8:
-                    tempRow.append(colorTable[(z*256)+(y*8)+(64*x)+a])
-                    a += 1
-                colorTable2 = colorTable2 + tempRow
-                tempRow.clear()
-                x += 1
-                a = 0
-            y += 1
-            x = 0
-        z += 1
-        y = 0
-    return colorTable2
-    
-def drawTileset():   
-    colTable = []
-    t = 1
-    x = 0
-    y = 0
+        partTile = charCache.getChar(tileAdr, tilePal, hMirror != 0, vMirror != 0)     #Colored and mirrored character, decoded only once per state
+        charGrid[x // 4, :, x % 4] = partTile
+        x += 1
+    return fullTileImage
+
+#Draws the full 512x512 tileset sheet from a save state and returns it as a BGR array
+#An already decoded palette and character table can be passed in, otherwise they are read from the save state
+#If the palette is the table from readIndexTable, the sheet holds color indices for an indexed PNG instead
+#With usedOnly, only the tiles that are placed somewhere in the level are drawn and every other slot is left blank (color 0 of the palette table)
+def drawTileset(state, palette=None, showStats=True, charTable=None, usedOnly=False):
+    import numpy as np
+    if palette is None:
+        palette = readPalette(state)
+    if usedOnly:
+        tileCount = countTiles(state)
+        usedTiles = [tileValue for tileValue in range(1, 256) if tileCount[tileValue] != 0]
+    if charTable is None:
+        charTable = readCharTable(state, usedChars(state, usedTiles) if usedOnly else None)    #With usedOnly, only the characters of the used tiles are decoded
+    charCache = CharCache(charTable, palette)
+    #Same idea as in drawFullTile: the 512x512 sheet is allocated once and viewed as a 16x16 grid of 32x32 tiles
+    channels = palette.shape[1]
+    colTable2 = np.empty((512, 512, channels), dtype=np.uint8)
+    if usedOnly:
+        colTable2[:, :] = palette[0]                    #Blank slots get the transparent color
+    tileGrid = colTable2.reshape(16, 32, 16, 32, channels)
     z = 0
-    r = 0
-    tempRow = []
-    tempRow2 = []
     while z < 16:
-        while t < 17:
-            colTable = colTable + drawFullTile(t+(16*z))
+        t = 0
+        while t < 16:
+            tileValue = t+1+(16*z)                      #Tile 0 is empty, so the first slot in the sheet is tile 1
+            if (not usedOnly) or ((tileValue < 256) and (tileCount[tileValue] != 0)):
+                tileGrid[z, :, t] = drawFullTile(state, tileValue, charCache)
             t += 1
-        while y < 32:
-            while x < 16:
-                while r < 32:
-                    tempRow.append(colTable[r+(x*1024)+(y*32)])
-                    r += 1
-                x += 1
-                r = 0
-            y += 1
-            x = 0
         z += 1
-        t = 1
-        y = 0
-        tempRow2 = tempRow2 + tempRow
-        tempRow.clear()
-        colTable.clear()
-    
-    colTable2 = np.asarray(tempRow2,dtype='uint8')
-    colTable2 = colTable2.reshape(32*z,512,3)
-    cv2.imwrite(tilesetPath, colTable2)
-
-if (args.importmode == '0'):
-    file.seek(levelIndex, 0)                                #Read the level index to figure out what level is being handled
-    lIndex=list(file.read(1))                               #The name of the level is not stored in RAM, so a table is used to print it here
-    print("Tileset loaded from save state:",lIndex[0],"-",lName[lIndex[0]])                       #Level number index + level name printed
- 
-if (tilesetPath == None) or (tilesetPath =="%mappath"):
-    print("No tileset path was specified. Saving tileset to current working directory.") 
-    tilesetPath = str(lIndex[0])+" - "+lName[lIndex[0]]+".png"
-else:
-    if (re.search('/',tilesetPath)):                       #Copying paths from the explorer can sometimes use backslash. We do not want to mix these.
-        tilesetPath = tilesetPath + "/Tilesets/"
+    if showStats:
+        charCache.printStats()
+    return colTable2
+
+#Counts how many times every tile value (0-255) is placed in the level, the level is one byte per tile at 0x4B20
+def countTiles(state):
+    import numpy as np
+    return np.bincount(np.frombuffer(state.level, dtype=np.uint8), minlength=256)
+
+#Prints how often every tile is used in the level, most used first. Tile 0 is the empty tile and is not listed
+#Only the first topAmt tiles are listed if topAmt is given
+def printTileUsage(tileCount, topAmt=None):
+    import numpy as np
+    usedTiles = np.flatnonzero(tileCount[1:]) + 1
+    usedTiles = usedTiles[np.argsort(-tileCount[usedTiles], kind='stable')]     #Most used first, equal counts stay in tile order
+    print("--TILE USAGE--")
+    print("Tiles used:",len(usedTiles),"/ 255 - Empty tiles (0):",int(tileCount[0]),"/",int(tileCount.sum()))
+    if topAmt is not None:
+        usedTiles = usedTiles[:topAmt]
+    if len(usedTiles) == 0:
+        return
+    maxCount = tileCount[usedTiles[0]]
+    for tileValue in usedTiles:
+        barLength = max(1, (tileCount[tileValue] * 40) // maxCount)
+        print("{0:>5}{1:>7}  {2}".format(int(tileValue), int(tileCount[tileValue]), "#" * int(barLength)))
+
+#A PNG file is a signature followed by chunks, every chunk is stored as length, type, data and a CRC of the type and data
+def pngChunk(chunkType, data):
+    return struct.pack(">I", len(data)) + chunkType + data + struct.pack(">I", zlib.crc32(chunkType + data))
+
+#Encodes an 8-bit indexed PNG from a sheet of color indices (see readIndexTable) and the palette table (see readPalette)
+#Index 0 is made transparent with a tRNS chunk, so the image doesn't need the 0x010101 chroma key. This way OpenCV is not needed at all
+def encodeIndexedPNG(indices, palette):
+    import numpy as np
+    height, width = indices.shape[0], indices.shape[1]
+    rows = np.zeros((height, width+1), dtype=np.uint8)         #Every row starts with a filter type byte, 0 = no filter
+    rows[:, 1:] = indices.reshape(height, width)
+    png = [b"\x89PNG\r\n\x1a\n"]
+    png.append(pngChunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)))   #8 bits per pixel, color type 3 = indexed
+    png.append(pngChunk(b"PLTE", palette[:, ::-1].tobytes()))  #PNG palettes are RGB, the palette table is BGR
+    png.append(pngChunk(b"tRNS", b"\x00"))                    #Alpha of index 0 is 0, every index after that is left out which means fully opaque
+    png.append(pngChunk(b"IDAT", zlib.compress(rows.tobytes(), 9)))
+    png.append(pngChunk(b"IEND", b""))
+    return b"".join(png)
+
+#Saves the tileset sheet as a PNG named after the level. If a map path was given, the sheet goes into a Tilesets folder there along with a .tsx file for Tiled
+#If a palette is given, the sheet holds color indices and is saved as an indexed PNG. Otherwise it's a BGR sheet which is saved with OpenCV
+def saveTileset(sheet, tilesetPath, lIndex, palette=None):
+    if (tilesetPath == None) or (tilesetPath =="%mappath"):
+        print("No tileset path was specified. Saving tileset to current working directory.") 
+        tilesetPath = str(lIndex)+" - "+lName[lIndex]+".png"
     else:
-        tilesetPath = tilesetPath + "\\Tilesets\\"
-    if not os.path.exists(tilesetPath):
-        os.makedirs(tilesetPath)
-        print(tilesetPath)
-        print("Folder for tilesets does not exist. Creating a new folder in the same folder as the map file.")
-    tilesetPath = tilesetPath + str(lIndex[0])+" - "+lName[lIndex[0]]+".png"
-    print("Saving tileset to:",tilesetPath)
-    #This is the formatting of Tiled's .tsx file, this may change though with later versions of Tiled. If so, this list has to be adjusted accordingly
-    formatList = [
-        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n",
-        "<tileset version=\"1.10\" tiledversion=\"1.10.2\" name=\"{0}\" tilewidth=\"32\" tileheight=\"32\" tilecount=\"256\" columns=\"16\">\n",
-        " <image source=\"{0}\" trans=\"010101\" width=\"512\" height=\"512\"/>\n",
-        "</tileset>\n"
-    ]
-    
-    tsxFile = tilesetPath
-    tsxFile = tsxFile.replace('.png','.tsx')
-    tsx = open(tsxFile, 'w')
-    print("Saving tileset tsx file to:",tsxFile)
-    x = 0
-    for i in formatList:
-        if x == 1:
-            reformat = "\n %s" %(i.format(lName[lIndex[0]]))
-            tsx.write(reformat)
-        elif x == 2:
-            reformat = "\n %s" %(i.format(tilesetPath))
-            tsx.write(reformat)
+        if (re.search('/',tilesetPath)):                       #Copying paths from the explorer can sometimes use backslash. We do not want to mix these.
+            tilesetPath = tilesetPath + "/Tilesets/"
         else:
-            tsx.write(i)
-        x += 1
-    tsx.close()
-    
-    
-drawTileset()
+            tilesetPath = tilesetPath + "\\Tilesets\\"
+        if not os.path.exists(tilesetPath):
+            os.makedirs(tilesetPath)
+            print(tilesetPath)
+            print("Folder for tilesets does not exist. Creating a new folder in the same folder as the map file.")
+        tilesetPath = tilesetPath + str(lIndex)+" - "+lName[lIndex]+".png"
+        print("Saving tileset to:",tilesetPath)
+        #This is the formatting of Tiled's .tsx file, this may change though with later versions of Tiled. If so, this list has to be adjusted accordingly
+        formatList = [
+            "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n",
+            "<tileset version=\"1.10\" tiledversion=\"1.10.2\" name=\"{0}\" tilewidth=\"32\" tileheight=\"32\" tilecount=\"256\" columns=\"16\">\n",
+            " <image source=\"{0}\" trans=\"010101\" width=\"512\" height=\"512\"/>\n",
+            "</tileset>\n"
+        ]
+        if palette is not None:
+            formatList[2] = formatList[2].replace(" trans=\"010101\"", "")  #Indexed PNGs have real transparency, so there's no chroma key
+        
+        tsxFile = tilesetPath
+        tsxFile = tsxFile.replace('.png','.tsx')
+        tsx = open(tsxFile, 'w')
+        print("Saving tileset tsx file to:",tsxFile)
+        x = 0
+        for i in formatList:
+            if x == 1:
+                reformat = "\n %s" %(i.format(lName[lIndex]))
+                tsx.write(reformat)
+            elif x == 2:
+                reformat = "\n %s" %(i.format(tilesetPath))
+                tsx.write(reformat)
+            else:
+                tsx.write(i)
+            x += 1
+        tsx.close()
+    if palette is None:
+        import cv2
+        cv2.imwrite(tilesetPath, sheet)
+    else:
+        with open(tilesetPath, "wb") as f:
+            f.write(encodeIndexedPNG(sheet, palette))
+
+#Reads one save state and saves its tileset, same as running this script with a single save state
+#The tileset is saved as an indexed PNG, or as an RGB image with the 0x010101 chroma key if rgb is True
+#With usedOnly, tiles that are not placed in the level are left blank. histogram prints the tile usage, True for every tile or a number to only list the most used ones
+def ripTileset(fileName, tilesetPath=None, rgb=False, usedOnly=False, histogram=None):
+    state = SaveState(fileName)                         #The whole save state is read once, VRAM, CGRAM and the tilemap are read from here
+    lIndex = state.levelIndex()                         #Read the level index to figure out what level is being handled
+    print("Tileset loaded from save state:",lIndex,"-",lName[lIndex])                       #Level number index + level name printed
+    if histogram not in (None, False):
+        printTileUsage(countTiles(state), None if histogram is True else histogram)
+    if rgb:
+        sheet = drawTileset(state, usedOnly=usedOnly)
+        saveTileset(sheet, tilesetPath, lIndex)
+    else:
+        sheet = drawTileset(state, readIndexTable(), usedOnly=usedOnly)
+        saveTileset(sheet, tilesetPath, lIndex, readPalette(state))
+    return sheet
+
+#Scores how well every tile in the sheet is loaded in a save state, used to pick the best source for each tile when merging several states
+#VRAM only holds what is currently loaded, but the unpacked copy at 0x18000 in WRAM has every character of the level in the same layout as VRAM
+#The score of a tile is the amount of its 16 characters that are identical in VRAM and in the unpacked copy, so 16 means the tile is fully loaded
+#With usedOnly, tiles that are not placed in the level (and so are left blank by drawTileset) get the lowest score of -1, so a drawn tile from another state always wins
+def scoreTiles(state, usedOnly=False):
+    import numpy as np
+    vramChars = np.frombuffer(state.vram[:1024*32], dtype=np.uint8).reshape(1024, 32)
+    copyChars = np.frombuffer(state.wram[vram2Address:vram2Address+(1024*32)], dtype=np.uint8).reshape(1024, 32)
+    charMatch = (vramChars == copyChars).all(axis=1)
+    tileEntries = np.frombuffer(state.tilemap[32:], dtype='<u2').reshape(256, 16)   #Tile 1-256, same order as in the sheet
+    scores = charMatch[tileEntries & 1023].sum(axis=1)
+    if usedOnly:
+        usedMask = np.append(countTiles(state)[1:] != 0, False)                     #Same tiles as drawTileset draws, tile 256 is never placed in a level
+        scores[~usedMask] = -1
+    return scores
+
+#Worker for the batch mode, reads and draws one save state. This runs in its own process so it can not rely on anything set up by the command line
+#Unless rgb is True, the sheet holds color indices and the palette table is returned along with it
+def ripState(fileName, rgb=False, usedOnly=False):
+    state = SaveState(fileName)
+    lIndex = state.levelIndex()
+    if lIndex >= len(lName):
+        return fileName, lIndex, None, None, None
+    if rgb:
+        return fileName, lIndex, drawTileset(state, showStats=False, usedOnly=usedOnly), scoreTiles(state, usedOnly), None
+    return fileName, lIndex, drawTileset(state, readIndexTable(), False, usedOnly=usedOnly), scoreTiles(state, usedOnly), readPalette(state)
+
+#Expands the command line into a sorted list of save states, directories are searched for .bst files
+def findStates(paths):
+    stateFiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(".bst"):
+                    stateFiles.append(os.path.join(path, name))
+        else:
+            stateFiles.append(path)
+    return stateFiles
+
+#Puts together one sheet out of several sheets of the same level, every tile is taken from the sheet with the highest score for that tile
+#If several sheets have the same score, the first one (sorted by file name) is used
+def mergeSheets(sheets, scores):
+    import numpy as np
+    bestSource = np.argmax(np.stack(scores), axis=0)
+    merged = np.empty_like(sheets[0])
+    mergedGrid = merged.reshape(16, 32, 16, 32, -1)
+    for slot, source in enumerate(bestSource):
+        mergedGrid[slot // 16, :, slot % 16] = sheets[source].reshape(16, 32, 16, 32, -1)[slot // 16, :, slot % 16]
+    return merged, bestSource
+
+#Batch mode: draws every save state in a process pool, then merges the sheets into one sheet per level index
+#Indexed sheets can only be merged if every save state of the level has the same palettes, otherwise that level is saved as RGB
+def ripBatch(stateFiles, tilesetPath, workers=None, rgb=False, usedOnly=False, histogram=None):
+    import numpy as np
+    validFiles = []
+    for fileName in stateFiles:
+        if os.path.getsize(fileName) != stateSize:
+            print("WARNING: Skipping",fileName,"- save state has the wrong file size")
+        else:
+            validFiles.append(fileName)
+    print("Reading",len(validFiles),"save states")
+    levels = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for fileName, lIndex, sheet, scores, palette in pool.map(functools.partial(ripState, rgb=rgb, usedOnly=usedOnly), validFiles):
+            if sheet is None:
+                print("WARNING: Skipping",fileName,"- unknown level index",lIndex)
+                continue
+            print(fileName,"-",lIndex,"-",lName[lIndex],"- Fully loaded tiles:",int((scores == 16).sum()),"/ 256")
+            levels.setdefault(lIndex, []).append((fileName, sheet, scores, palette))
+    for lIndex in sorted(levels):
+        sources = levels[lIndex]
+        palette = sources[0][3]
+        if (palette is not None) and any(not np.array_equal(i[3], palette) for i in sources):
+            print("\nWARNING: Palettes differ between the save states of level",lIndex,"- saving it as RGB")
+            sources = [(i[0], i[3][i[1][:, :, 0]], i[2], None) for i in sources]   #Look up the color of every index with its own palette
+            palette = None
+        merged, bestSource = mergeSheets([i[1] for i in sources], [i[2] for i in sources])
+        bestScores = np.stack([i[2] for i in sources]).max(axis=0)
+        print("\nTileset for level",lIndex,"-",lName[lIndex],"merged from",len(sources),"save states - Fully loaded tiles:",int((bestScores == 16).sum()),"/ 256")
+        for idx, source in enumerate(sources):
+            print("  ",source[0],"- Tiles used:",int((bestSource == idx).sum()))
+        if histogram not in (None, False):
+            printTileUsage(countTiles(SaveState(sources[0][0])), None if histogram is True else histogram)
+        saveTileset(merged, tilesetPath, lIndex, palette)
+
+#Argument type of --histogram: the amount of tiles to list, which has to be at least 1
+#A save state given right after a bare --histogram ends up here as well, so the error says how to fix that
+def histogramAmount(value):
+    try:
+        amount = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("'{0}' is not a number of tiles. To list every tile, put --histogram after the save state".format(value))
+    if amount < 1:
+        raise argparse.ArgumentTypeError("{0} tiles can not be listed, use 1 or more (or no number to list every tile)".format(amount))
+    return amount
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                        prog='Readtileset',
+                        description='Toy Story SNES Tileset Exporter - Read a BSNES-Plus or other SNES emulator save state and export the tilemap to Tiled.',
+                        epilog='Usage: readtileset state levelfile --tileset --importmode --rnc')
+
+    parser.add_argument('statefile', 
+                        metavar='S',
+                        nargs='+',
+                        help='BSNES save state file to read from (.bst). ROM file if in mode 1. Several save states or a folder of save states are merged into one tileset per level')    
+    parser.add_argument('--levelfile', 
+                        metavar='L',
+                        required=False,
+                        help='Tiled level file to read from (.tmx)')                    
+    parser.add_argument('--tileset', 
+                        metavar='T',
+                        help='Saves the tileset at the user specified location')
+    parser.add_argument('--importmode', 
+                        metavar='I',
+                        help='Import mode (0-1). 0 if importing from a save state, 1 if importing directly from ROM',
+                        required=False,
+                        default='0')
+    parser.add_argument('--rnc', 
+                        metavar='R',
+                        help='Path to RNC compression runtimes. Required if using export mode 1',
+                        required=False,
+                        default=None)   
+    parser.add_argument('--rgb', 
+                        action='store_true',
+                        help='Save the tileset as an RGB image with the 010101 chroma key (requires OpenCV) instead of an indexed PNG')
+    parser.add_argument('--usedonly', 
+                        action='store_true',
+                        help='Only draw the tiles that are placed in the level, unused slots in the tileset are left blank')
+    parser.add_argument('--histogram', 
+                        metavar='N',
+                        type=histogramAmount,
+                        nargs='?',
+                        const=-1,                                       #Sentinel for --histogram without a number, histogramAmount never returns it
+                        default=None,
+                        help='Print how many times every tile is used in the level, most used first. Only the N most used tiles (1 or more) are listed if N is given. Without N, put it after the save state, or it is read as N')
+    parser.add_argument('--workers', 
+                        metavar='W',
+                        type=int,
+                        help='Amount of processes used when reading several save states. Defaults to the amount of CPU cores',
+                        required=False,
+                        default=None)
+
+    args = parser.parse_args()
+    print("Save state file:", ", ".join(args.statefile),"\nTileset path:",args.tileset)
+
+    levelFile = args.levelfile
+    tilesetPath = args.tileset                          #The user can specify a custom tileset path
+    if (args.importmode == '1'):                        #Coming soon, need to figure out ROM addresses for the RNC packets before this can be implemented
+        print("Importing from ROM file is not yet supported with this script.")
+        sys.exit()
+    histogram = args.histogram
+    if histogram == -1:                                 #--histogram without a number lists every used tile
+        histogram = True
+    stateFiles = findStates(args.statefile)
+    if (len(stateFiles) > 1) or os.path.isdir(args.statefile[0]):
+        ripBatch(stateFiles, tilesetPath, args.workers, args.rgb, args.usedonly, histogram)     #Several save states, every level found gets its own merged tileset
+        sys.exit()
+    fileName = stateFiles[0]                            #Save state to read the level data from
+    if (os.path.getsize(fileName) != stateSize) and (args.importmode == '0'):
+        print("ERROR: Save state has the wrong file size. Has the correct file been chosen?")
+        sys.exit()
+    if ((os.path.getsize(fileName) != romSize) and (args.importmode == '1')):
+        print("ERROR: ROM has the wrong file size. Has the correct file been chosen?")
+        sys.exit()
+    if levelFile != None:
+        if (re.search('[^0-9]',levelFile)) and not ((levelFile != "%mapfile") or (levelFile != None)):       
+            lIndex = int(re.sub('[^0-9]', '', levelFile))
+            print("Found level index:",lIndex)
+        elif not (re.search('[^0-9]',levelFile)) and (args.importmode == '1'): 
+            print("ERROR: Can not find which level to import from. Create a level file with a number (0-15) and then try again")
+            sys.exit()
+        elif not ((re.search('[^0-9]',levelFile)) or levelFile == "%mapfile") and (args.importmode == '0'):
+            print("No map file is loaded.")
 
-file.close()
+    ripTileset(fileName, tilesetPath, args.rgb, args.usedonly, histogram)
 
 #18B7C - Start of VRAM for left-side bookshelf character in LVL1, BST save state 
 #18B7C minus State offset (21C) = 18960 = offset is 960 for this particular character from start of VRAM
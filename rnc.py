@@ -0,0 +1,388 @@
+#RNC ProPack compression (method 1), which is how Toy Story stores the level tiles in ROM
+#Format as described by the RNC ProPack source (https://github.com/lab313ru/rnc_propack_source), so the external rnc tool is no longer needed
+#A packed block starts with an 18 byte big endian header: "RNC", the method (1), unpacked size, packed size, CRC of the unpacked data, CRC of the packed data, leeway and the amount of chunks
+#The packed data is a stream of 16-bit little endian words read from the lowest bit up, with the literal bytes stored in between the words
+
+import struct
+
+headerSize = 18
+rncSignature = b"RNC\x01"
+
+#CRC-16 with the reversed polynomial 0xA001, used for both the packed and unpacked data
+crcTable = []
+for i in range(256):
+    crc = i
+    for j in range(8):
+        crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    crcTable.append(crc)
+
+def crc16(data):
+    crc = 0
+    for byte in data:
+        crc = (crc >> 8) ^ crcTable[(crc ^ byte) & 255]
+    return crc
+
+#Reads the header of the packed block at offset, returns (unpacked size, packed size, unpacked CRC, packed CRC, leeway, chunk amount)
+#Raises a ValueError if there's no RNC method 1 block at offset
+def readHeader(data, offset=0):
+    if bytes(data[offset:offset+4]) != rncSignature:
+        raise ValueError("No RNC method 1 data at offset {0} (found {1})".format(hex(offset), bytes(data[offset:offset+4])))
+    return struct.unpack_from(">IIHHBB", data, offset+4)
+
+#Reads the bit stream of a packed block. The buffer always holds at least 16 bits, pos points at the last word that was loaded into it
+class BitReader:
+    def __init__(self, data, pos):
+        self.data = data
+        self.pos = pos
+        self.buffer = data[pos] | (data[pos+1] << 8)
+        self.count = 16
+
+    def peek(self, mask):
+        return self.buffer & mask
+
+    def advance(self, amt):
+        self.buffer >>= amt
+        self.count -= amt
+        if self.count < 16:
+            self.pos += 2
+            self.buffer |= (self.data[self.pos] | (self.data[self.pos+1] << 8)) << self.count
+            self.count += 16
+
+    def read(self, amt):
+        value = self.buffer & ((1 << amt)-1)
+        self.advance(amt)
+        return value
+
+    #Literal bytes are stored where the last word was loaded from, so that word is replaced by the one after the literals
+    def readBytes(self, amt):
+        value = self.data[self.pos:self.pos+amt]
+        self.pos += amt
+        self.count -= 16
+        self.buffer &= (1 << self.count)-1
+        self.buffer |= (self.data[self.pos] | (self.data[self.pos+1] << 8)) << self.count
+        self.count += 16
+        return value
+
+#Reads a Huffman table: 5 bits for the amount of codes, then 4 bits for the length of every code
+#The codes are canonical and stored with the bits reversed, the table maps every possible maxLength bit value to (value, code length)
+#Returns None if the chunk keeps the table of the previous chunk
+def readHuffmanTable(bits):
+    amt = bits.read(5)
+    if amt == 0:
+        return None
+    lengths = [bits.read(4) for i in range(amt)]
+    maxLength = max(max(lengths), 1)
+    table = [None] * (1 << maxLength)
+    code = 0
+    for length in range(1, maxLength+1):
+        for value in range(amt):
+            if lengths[value] == length:
+                mirror = int("{0:0{1}b}".format(code, length)[::-1], 2)
+                for high in range(0, 1 << maxLength, 1 << length):
+                    table[mirror | high] = (value, length)
+                code += 1
+        code <<= 1
+    return (table, (1 << maxLength)-1)
+
+#Values 0 and 1 are stored as they are, a higher value n is followed by n-1 bits and stands for a number from 2^(n-1) to 2^n-1
+def readHuffmanValue(bits, huffman):
+    if huffman == None:
+        raise ValueError("RNC data uses a Huffman table that was never defined")
+    table, mask = huffman
+    entry = table[bits.peek(mask)]
+    if entry == None:
+        raise ValueError("RNC data holds a Huffman code that is not in the table")
+    value, length = entry
+    bits.advance(length)
+    if value >= 2:
+        value = (1 << (value-1)) | bits.read(value-1)
+    return value
+
+#Unpacks the RNC method 1 block at offset, data can be anything that can be sliced such as bytes or a memory-mapped ROM
+#Raises a ValueError if the block is damaged or isn't RNC method 1 data
+def unpack(data, offset=0):
+    unpackedSize, packedSize, unpackedCrc, packedCrc, leeway, chunkAmt = readHeader(data, offset)
+    packed = bytes(data[offset+headerSize:offset+headerSize+packedSize])
+    if len(packed) != packedSize:
+        raise ValueError("RNC data at offset {0} is cut off ({1} of {2} bytes)".format(hex(offset), len(packed), packedSize))
+    if crc16(packed) != packedCrc:
+        raise ValueError("RNC data at offset {0} is damaged (CRC of the packed data does not match)".format(hex(offset)))
+    bits = BitReader(packed + bytes(4), 0)                      #The bit stream loads a word ahead, so it may read a little past the end
+    bits.advance(2)                                             #The first two bits are the lock and key flags, which aren't used here
+    output = bytearray()
+    literals = distances = lengths = None
+    try:
+        while len(output) < unpackedSize:
+            literals = readHuffmanTable(bits) or literals
+            distances = readHuffmanTable(bits) or distances
+            lengths = readHuffmanTable(bits) or lengths
+            subchunkAmt = bits.read(16)
+            while True:
+                amt = readHuffmanValue(bits, literals)
+                if amt > 0:
+                    if len(output)+amt > unpackedSize:
+                        raise ValueError("RNC data at offset {0} unpacks to more than {1} bytes".format(hex(offset), unpackedSize))
+                    output += bits.readBytes(amt)
+                subchunkAmt -= 1
+                if subchunkAmt <= 0:
+                    break
+                distance = readHuffmanValue(bits, distances) + 1
+                amt = readHuffmanValue(bits, lengths) + 2
+                if (distance > len(output)) or (len(output)+amt > unpackedSize):
+                    raise ValueError("RNC data at offset {0} is damaged (copies {1} bytes from {2} bytes back at {3})".format(hex(offset), amt, distance, len(output)))
+                if distance >= amt:
+                    start = len(output)-distance
+                    output += output[start:start+amt]
+                else:
+                    output += (output[-distance:] * ((amt // distance)+1))[:amt]    #The copy overlaps itself, so the last distance bytes repeat
+    except IndexError:
+        raise ValueError("RNC data at offset {0} ends before {1} bytes have been unpacked".format(hex(offset), unpackedSize))
+    if crc16(output) != unpackedCrc:
+        raise ValueError("RNC data at offset {0} is damaged (CRC of the unpacked data does not match)".format(hex(offset)))
+    return bytes(output)
+
+#Settings for pack(), from fastest to hardest: (how many earlier positions are tried for every match, lazy matching)
+#Lazy matching also tries a match one byte further along and keeps the longer one, which packs a little better but takes longer
+#The most seen over settings 0 on 113 test levels (sparse to dense maps of every level width) was 9.2% smaller for settings 1 and 13.4% for settings 2,
+#but that is no limit, so packToFit always tries every setting before giving up
+packSettings = [
+    (8, False),
+    (64, True),
+    (1024, True)
+]
+windowSize = 32768                                              #Largest distance a match can be copied from (the distance classes go up to 15 bits)
+maxMatch = 4096                                                 #Longest match that is written
+maxLiterals = 32767                                             #Longest literal run, longer runs would need a 16th value class
+maxSubchunks = 65535                                            #The amount of subchunks in a chunk is stored in 16 bits
+
+#Writes the bit stream of a packed block, the opposite of BitReader
+#Every 16-bit word is reserved in the output when its first bit is written, literal bytes added in the meantime end up behind it
+class BitWriter:
+    def __init__(self):
+        self.output = bytearray()
+        self.pos = None
+        self.word = 0
+        self.count = 16
+
+    def write(self, value, amt):
+        while amt > 0:
+            if self.count == 16:
+                self.flush()
+                self.pos = len(self.output)
+                self.output += b"\0\0"
+                self.word = 0
+                self.count = 0
+            part = min(amt, 16-self.count)
+            self.word |= (value & ((1 << part)-1)) << self.count
+            value >>= part
+            amt -= part
+            self.count += part
+
+    def writeBytes(self, data):
+        self.output += data
+
+    def flush(self):
+        if self.pos != None:
+            struct.pack_into("<H", self.output, self.pos, self.word)
+
+    def finish(self):
+        self.flush()
+        return bytes(self.output)
+
+#Length of the match between the bytes at candidate and pos, at least minLength bytes are already known to match
+def matchLength(data, candidate, pos, minLength, maxLength):
+    if data[candidate:candidate+maxLength] == data[pos:pos+maxLength]:
+        return maxLength
+    low = minLength                                             #Binary search on slices, comparing the bytes is left to Python itself
+    high = maxLength-1
+    while low < high:
+        middle = (low+high+1) // 2
+        if data[candidate:candidate+middle] == data[pos:pos+middle]:
+            low = middle
+        else:
+            high = middle-1
+    return low
+
+#Splits the data into (literal bytes, distance, length) tokens with LZ77, using chains of earlier positions that start with the same 3 bytes
+#Tokens without a match (distance and length are None) end a chunk, the last token is always one of them
+def findMatches(data, chainLimit=8, lazy=False):
+    chains = {}
+    def longestMatch(pos):
+        maxLength = min(maxMatch, len(data)-pos)
+        if maxLength < 3:
+            return 0, 0
+        bestLength, bestDistance = 2, 0
+        candidates = chains.get(data[pos:pos+3], ())
+        for i in range(len(candidates)-1, max(len(candidates)-chainLimit, 0)-1, -1):
+            candidate = candidates[i]
+            if pos-candidate > windowSize:
+                break
+            if data[candidate+bestLength] != data[pos+bestLength]:     #Can't be longer than the best match so far
+                continue
+            length = matchLength(data, candidate, pos, 3, maxLength)
+            if length > bestLength:
+                bestLength, bestDistance = length, pos-candidate
+                if length == maxLength:
+                    break
+        if bestDistance == 0:
+            return 0, 0
+        return bestLength, bestDistance
+    def insert(pos):
+        chains.setdefault(data[pos:pos+3], []).append(pos)
+    tokens = []
+    start = 0
+    pos = 0
+    while pos < len(data):
+        length, distance = longestMatch(pos)
+        if (length > 0) and lazy and (pos+1 < len(data)) and (pos+1-start < maxLiterals):
+            insert(pos)
+            nextLength, nextDistance = longestMatch(pos+1)
+            if nextLength > length:
+                pos += 1                                        #The byte at pos becomes a literal and the longer match is used instead
+                length, distance = nextLength, nextDistance
+            else:
+                chains[data[pos:pos+3]].pop()                   #Inserted again below, together with the rest of the match
+        if length == 0:
+            insert(pos)
+            pos += 1
+            if pos-start == maxLiterals:                        #The literal run can't get any longer, so it ends without a match
+                tokens.append((data[start:pos], None, None))
+                start = pos
+            continue
+        tokens.append((data[start:pos], distance, length))
+        for i in range(pos, pos+length):
+            insert(i)
+        pos += length
+        start = pos
+    if (len(tokens) == 0) or (start < len(data)) or (tokens[-1][1] != None):
+        tokens.append((data[start:], None, None))
+    return tokens
+
+#Huffman code lengths for the frequency of every value, at most 16 values are used so no code is longer than 15 bits
+def huffmanLengths(frequency):
+    import heapq
+    lengths = [0] * len(frequency)
+    heap = [(amt, value, [value]) for value, amt in enumerate(frequency) if amt > 0]
+    if len(heap) == 1:
+        lengths[heap[0][1]] = 1
+    heapq.heapify(heap)
+    while len(heap) > 1:
+        amt1, value1, values1 = heapq.heappop(heap)
+        amt2, value2, values2 = heapq.heappop(heap)
+        for value in values1+values2:
+            lengths[value] += 1
+        heapq.heappush(heap, (amt1+amt2, min(value1, value2), values1+values2))
+    return lengths
+
+#Canonical codes for the code lengths, with the bits reversed like readHuffmanTable expects them
+def huffmanCodes(lengths):
+    codes = {}
+    code = 0
+    for length in range(1, max(lengths, default=0)+1):
+        for value in range(len(lengths)):
+            if lengths[value] == length:
+                codes[value] = (int("{0:0{1}b}".format(code, length)[::-1], 2), length)
+                code += 1
+        code <<= 1
+    return codes
+
+def writeHuffmanTable(bits, lengths):
+    amt = max([value+1 for value in range(len(lengths)) if lengths[value] > 0], default=0)
+    bits.write(amt, 5)
+    for length in lengths[:amt]:
+        bits.write(length, 4)
+
+def writeHuffmanValue(bits, codes, value):
+    valueClass = value.bit_length()
+    code, length = codes[valueClass]
+    bits.write(code, length)
+    if valueClass >= 2:
+        bits.write(value, valueClass-1)                         #BitWriter only keeps the low valueClass-1 bits, the top bit is implied by the class
+
+#Groups the tokens into chunks, every chunk ends with a subchunk that has no match
+def chunkTokens(tokens):
+    chunks = [[]]
+    for token in tokens:
+        chunks[-1].append(token)
+        if (token[1] == None) or (len(chunks[-1]) == maxSubchunks-1):
+            if token[1] != None:
+                chunks[-1].append((b"", None, None))
+            chunks.append([])
+    chunks.pop()
+    return chunks
+
+#Huffman code lengths of the literal run, distance and length tables of a chunk
+def chunkTables(chunk):
+    frequency = [[0] * 16 for i in range(3)]
+    for literals, distance, length in chunk:
+        frequency[0][len(literals).bit_length()] += 1
+        if distance != None:
+            frequency[1][(distance-1).bit_length()] += 1
+            frequency[2][(length-2).bit_length()] += 1
+    return [huffmanLengths(amt) for amt in frequency]
+
+#Packs the data as an RNC method 1 block (header included). effort is an index into packSettings
+def pack(data, effort=0):
+    data = bytes(data)
+    chainLimit, lazy = packSettings[effort]
+    chunks = chunkTokens(findMatches(data, chainLimit, lazy))
+    bits = BitWriter()
+    bits.write(0, 2)                                            #Lock and key flags
+    leeway = 0
+    unpackedPos = 0
+    for chunk in chunks:
+        tables = []
+        for lengths in chunkTables(chunk):
+            writeHuffmanTable(bits, lengths)
+            tables.append(huffmanCodes(lengths))
+        bits.write(len(chunk), 16)
+        for literals, distance, length in chunk:
+            writeHuffmanValue(bits, tables[0], len(literals))
+            bits.writeBytes(literals)
+            unpackedPos += len(literals)
+            leeway = max(leeway, unpackedPos-len(bits.output))  #How far the output gets ahead of the input, for unpacking in place
+            if distance != None:
+                writeHuffmanValue(bits, tables[1], distance-1)
+                writeHuffmanValue(bits, tables[2], length-2)
+                unpackedPos += length
+                leeway = max(leeway, unpackedPos-len(bits.output))
+    packed = bits.finish()
+    leeway = min(max(leeway-(len(data)-len(packed)), 0), 255)
+    return rncSignature + struct.pack(">IIHHBB", len(data), len(packed), crc16(data), crc16(packed), leeway, len(chunks)) + packed
+
+#Packs the data with every setting in packSettings until the packed block (header included) is at most maxSize bytes
+#Returns (packed block, effort that was used). If nothing fits, the smallest block is returned, so the caller has to check the size
+def packToFit(data, maxSize):
+    best = None
+    for effort in range(len(packSettings)):
+        packed = pack(data, effort)
+        if (best == None) or (len(packed) < len(best[0])):
+            best = (packed, effort)
+        if len(packed) <= maxSize:
+            break
+    return best
+
+#Size of the block that pack() makes with the same settings, worked out from the matches and Huffman tables without writing the bit stream
+#This is exact for the given settings. packToFit() starts with settings 0 and only keeps a harder setting if it's smaller,
+#so with effort 0 this is an upper bound on the size a ROM export ends up with
+def packedSize(data, effort=0):
+    data = bytes(data)
+    chainLimit, lazy = packSettings[effort]
+    bitAmt = 2
+    byteAmt = 0
+    for chunk in chunkTokens(findMatches(data, chainLimit, lazy)):
+        tables = chunkTables(chunk)
+        for lengths in tables:
+            bitAmt += 5 + (4 * max([value+1 for value in range(len(lengths)) if lengths[value] > 0], default=0))
+        bitAmt += 16
+        literalLengths, distanceLengths, lengthLengths = tables
+        for literals, distance, length in chunk:
+            valueClass = len(literals).bit_length()
+            bitAmt += literalLengths[valueClass] + max(valueClass-1, 0)
+            byteAmt += len(literals)
+            if distance != None:
+                valueClass = (distance-1).bit_length()
+                bitAmt += distanceLengths[valueClass] + max(valueClass-1, 0)
+                valueClass = (length-2).bit_length()
+                bitAmt += lengthLengths[valueClass] + max(valueClass-1, 0)
+    return headerSize + (2 * ((bitAmt+15) // 16)) + byteAmt
@@ -0,0 +1,85 @@
+#Cache of unpacked ROM levels, so a level that hasn't changed in the ROM doesn't have to be unpacked again on the next import
+#Every level is stored in the cache folder next to the scripts as a file named after the hash of its packed block in the ROM (header included),
+#so editing the ROM gives a new hash and the old entry is never used again. Once the folder is bigger than cacheSize,
+#the entries that were used the longest time ago are removed (the modification time is updated every time an entry is used)
+
+import hashlib
+import os
+import tempfile
+import rnc
+
+cacheFolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "romcache")
+cacheSize = 1048576                                 #1 MB, enough for 128 unpacked levels
+hits = 0                                            #Hits and misses of this process, printed by the import scripts
+misses = 0
+
+#Hash of the packed block at offset, header included. Raises a ValueError if there's no RNC data at offset
+def cacheKey(data, offset):
+    packedSize = rnc.readHeader(data, offset)[1]
+    return hashlib.sha256(data[offset:offset+rnc.headerSize+packedSize]).hexdigest()
+
+#Removes the least recently used entries until the cache folder holds at most maxSize bytes
+def trimCache(folder=cacheFolder, maxSize=cacheSize):
+    entries = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.endswith(".bin"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    totalSize = sum(i[1] for i in entries)
+    for mtime, size, path in sorted(entries):
+        if totalSize <= maxSize:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:                   #Another process removed it first
+            pass
+        totalSize -= size
+
+#Unpacks the RNC block at offset like rnc.unpack, but from the cache if it has been unpacked before. Returns (unpacked data, True if it came from the cache)
+#folder=None skips the cache. Entries are checked against the CRC in the header, a damaged entry is unpacked again and replaced
+#The cache is only a speed up, so if it can't be read or written (read-only folder, full disk) the level is simply unpacked from the ROM
+#Raises a ValueError if the block can't be unpacked
+def unpackCached(data, offset, folder=cacheFolder, maxSize=cacheSize):
+    global hits, misses
+    if folder == None:
+        return rnc.unpack(data, offset), False
+    unpackedSize, packedSize, unpackedCrc = rnc.readHeader(data, offset)[:3]
+    path = os.path.join(folder, cacheKey(data, offset) + ".bin")
+    try:
+        with open(path, "rb") as f:
+            unpacked = f.read()
+        if (len(unpacked) == unpackedSize) and (rnc.crc16(unpacked) == unpackedCrc):
+            try:
+                os.utime(path)                          #Marks the entry as used, for trimCache
+            except OSError:
+                pass
+            hits += 1
+            return unpacked, True
+    except OSError:                                     #Not in the cache (or the cache can't be read)
+        pass
+    unpacked = rnc.unpack(data, offset)
+    misses += 1
+    tempName = None
+    try:
+        os.makedirs(folder, exist_ok=True)
+        handle, tempName = tempfile.mkstemp(dir=folder, suffix=".tmp")     #Renamed into place once complete, so other processes never read half an entry
+        with os.fdopen(handle, "wb") as f:
+            f.write(unpacked)
+        os.replace(tempName, path)
+        tempName = None
+        trimCache(folder, maxSize)
+    except OSError:                                     #The level was unpacked anyway, it just isn't cached
+        pass
+    finally:
+        if tempName != None:
+            try:
+                os.remove(tempName)
+            except OSError:
+                pass
+    return unpacked, False
+
+#Hit and miss counts of this process as they're printed to the console
+def cacheStats(hitAmt=None, missAmt=None):
+    hitAmt = hits if hitAmt == None else hitAmt
+    missAmt = misses if missAmt == None else missAmt
+    return "Level cache: {0} {1}, {2} {3}".format(hitAmt, "hit" if hitAmt == 1 else "hits", missAmt, "miss" if missAmt == 1 else "misses")
@@ -0,0 +1,103 @@
+#Shared save state reader for the SNES Toy Story tools (state2level.py, level2state.py and readtileset.py)
+#The whole save state is read in one go, and every memory region the tools care about is handed out as a memoryview slice
+#Slicing a memoryview does not copy anything, so all tools can look at the same buffer instead of doing lots of small seek + read calls
+
+import os
+import shutil
+import tempfile
+
+stateSize = 289885                                  #Exact size of a BSNES save state, a fail safe just in case an invalid file was chosen
+stateOffset = int("21C", 16)                        #Offset from 0 off save states, BSNES savestates has some data before the actual RAM so zero offset is at 21C
+
+#Addresses below are defined as they show up in RAM on an emulator, the stateOffset is added by SaveState
+wramSize = int("20000", 16)                         #128 KB of work RAM
+vramAddress = int("30000", 16)                      #VRAM (64 KB) is stored after WRAM in the save state
+vramSize = int("10000", 16)
+cgramAddress = int("40220", 16)                     #Color graphics RAM, comes after VRAM and OAM (544 bytes)
+cgramSize = int("200", 16)                          #256 colors, but only the first 128 (8 palettes of 16 colors) are used for the level tiles
+levelIndexAddress = int("1A", 16)                   #Level index
+objectAddress = int("A00", 16)                      #Starting location in RAM where objects are stored
+objectSize = 48*48                                  #48 bytes per creature and a total of 48 creatures
+levelAddress = int("4B20", 16)                      #First tile in any level
+levelSize = int("2000", 16)                         #8192 tiles, one byte each
+tilemapAddress = int("2B20", 16)                    #Table of full 32x32 tiles, each one made up of 16 characters (32 bytes)
+tilemapSize = 257*32                                #Tile 256 is invalid and reads into the level data, but the tileset ripper still draws it
+dirtyGap = 16                                       #Changed bytes this close to each other are written as one range, a few unchanged bytes are cheaper than another seek
+
+class SaveState:
+    def __init__(self, fileName, writable=False):
+        self.fileName = fileName
+        self.dirty = []                                     #Byte ranges in the file (start, end) changed by update that haven't been written yet
+        with open(fileName, "rb") as f:                     #Read the whole file once, the file handle is not kept open
+            data = f.read()
+        if writable:
+            data = bytearray(data)                          #A bytearray is required for the memoryviews to be writable
+        self.data = data
+        self.view = memoryview(data)
+        self.ram = self.view[stateOffset:]                  #RAM as it is seen in the emulator, address 0 = stateOffset in the file
+        self.wram = self.ram[:wramSize]
+        self.vram = self.ram[vramAddress:vramAddress+vramSize]
+        self.cgram = self.ram[cgramAddress:cgramAddress+cgramSize]
+        self.level = self.wram[levelAddress:levelAddress+levelSize]
+        self.creatures = self.wram[objectAddress:objectAddress+objectSize]
+        self.tilemap = self.wram[tilemapAddress:tilemapAddress+tilemapSize]
+
+    def isValid(self):                                      #Fail safe, a BSNES save state always has the exact same size
+        return len(self.data) == stateSize
+
+    def levelIndex(self):
+        return self.ram[levelIndexAddress]
+
+    def readWord(self, address):                            #Reads a 16-bit little endian value from RAM
+        return self.ram[address] + (self.ram[address+1]*256)
+
+    #Writes data to RAM at the given address, both in the buffer and in the save state file itself
+    #Same as update followed by commit, so only the bytes that changed are touched on disk
+    def write(self, address, data):
+        self.update(address, data)
+        self.commit()
+
+    #Changes RAM at the given address in the buffer only, the save state file is left alone until commit is called
+    #Only the bytes that differ from what's already in the save state are marked to be written. Returns the amount of bytes that changed
+    #The changed bytes are found with NumPy in one go, then merged into ranges wherever they're at most dirtyGap bytes apart
+    def update(self, address, data):
+        import numpy as np
+        old = self.ram[address:address+len(data)]
+        if old == data:
+            return 0
+        changedIndex = np.flatnonzero(np.frombuffer(old, dtype=np.uint8) != np.frombuffer(data, dtype=np.uint8))
+        splits = np.flatnonzero(np.diff(changedIndex) > dirtyGap)              #A new range starts after every gap that is too big
+        starts = changedIndex[np.concatenate(([0], splits+1))]
+        ends = changedIndex[np.concatenate((splits, [len(changedIndex)-1]))] + 1
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            self.dirty.append((stateOffset+address+start, stateOffset+address+end))
+        self.ram[address:address+len(data)] = data
+        return len(changedIndex)
+
+    #Writes everything changed by update to the save state file, returns the amount of byte ranges that were written
+    #With atomic, the whole save state is written to a temporary file next to it, which is then renamed over the save state
+    #This way the save state is either fully updated or not touched at all, even if the script is stopped halfway
+    def commit(self, atomic=False):
+        ranges = self.dirty
+        self.dirty = []
+        if len(ranges) == 0:
+            return 0
+        if atomic:
+            handle, tempName = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.fileName)), suffix=".tmp")
+            try:
+                with os.fdopen(handle, "wb") as f:
+                    f.write(self.data)
+                    f.flush()
+                    os.fsync(f.fileno())                    #Make sure the data is on disk before the rename makes it the save state
+                shutil.copymode(self.fileName, tempName)
+                os.replace(tempName, self.fileName)
+            except BaseException:
+                if os.path.exists(tempName):
+                    os.remove(tempName)
+                raise
+        else:
+            with open(self.fileName, "r+b") as f:
+                for start, end in ranges:
+                    f.seek(start, 0)
+                    f.write(self.view[start:end])
+        return len(ranges)
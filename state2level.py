@@ -5,71 +5,21 @@ import re               #We need regex to help us search through the csv format
 import os               #Used for some file read/write features
 import sys              #Used for some file read/write features
 import argparse         #Used to parse arguments so that this script can be used with Tiled's command feature
-import subprocess
-
-#Argument parser function
-parser = argparse.ArgumentParser(
-                    prog='State2Level',
-                    description='Toy Story SNES Level Exporter - Read a BSNES-Plus or other SNES emulator save state and export the level data to Tiled.',
-                    epilog='Usage: state2level INPUT OUTPUT MAPPATH TILESET')
-
-parser.add_argument('statefile')                     #The path to the save state has to be provided in full inside the command string
-parser.add_argument('levelfile')                     #Tiled supports parsing the filename that it is currently editing into this script, %mapfile
-parser.add_argument('levelpath')                     #This is sent directly from a Tiled variable called %mappath
-parser.add_argument('--tileset',required=False)      #Optional: Tileset used for the level file. Not technically required, but the user definitely will want one
-parser.add_argument('--importmode', 
-                    metavar='M',
-                    help='Import mode (0-1). 0 if importing from a save state, 1 if importing directly from ROM',
-                    required=False,
-                    default='0')
-parser.add_argument('--rnc', 
-                    metavar='R',
-                    help='Path to RNC compression runtimes. Required if using export mode 1',
-                    required=False,
-                    default=None)   
-
-args = parser.parse_args()
-print("Save state file:", args.statefile,"\nLevel file:",args.levelfile,"\nTile set:",args.tileset)
-
-fileName = args.statefile                           #Save state to read the level data from
-levelFile = args.levelfile                          #Tiled level file, the data read from the save state will be exported here
-tiledPath = args.levelpath                          #Path to the map file, as parsed from Tiled
-rncPath = args.rnc                                  #Path to RNC runtimes (import mode 1)
-
-file = open(fileName,"r+b")                         #Points to the RAM dump or save state we want to load from in binary write mode
-stateSize = 289885                                  #Exact size of a BSNES save state, a fail safe just in case an invalid file was chosen
+import struct           #Used to unpack the creature table
+from savestate import SaveState, stateSize, stateOffset
+from tiledlayer import layerFormats, dataAttributes, encodeLayer, encodeChunks, loadZstd
+
+#Everything in this script is split up into functions, so it can be imported and used from other Python tools as well as from Tiled
+#Example: importLevel("TS2-1.bst", "C:/Tiled/Maps/test.tmx", "C:/Tiled/Maps") does the same as running the script with those arguments
+
 romSize = 4194304                                   #Exact size of ROM, fail safe for import mode 1
 
-#Offsets will be defined here. They are all defined as stateOffset+value because then this script can be adjusted for different emulator save state formats
+#Offsets are defined in savestate.py as they show up in RAM on an emulator, SaveState adds the stateOffset
 #RAM dump will have offset 0x0, while a BSNES-plus save state has an offset of 0x21C to get to the same address
-stateOffset = int("21C", 16)                        #Offset from 0 off save states, when used with a BSNES RAM dump this should be just 0
-objectOffset = stateOffset+int("A00", 16)           #By using stateOffset as reference, we can define the values as they show up in RAM on an emulator
-levelOffset = stateOffset+int("4B20", 16)           #First tile in any level
-levelIndex = stateOffset+int("1A", 16)              #Level index
+levelOffset = stateOffset+int("4B20", 16)           #First tile in any level, only used for diagnostics
 
 createNew = True                                    #If true, this script creates a whole new .tmx file instead of editing an existing one. Edit mode might be less stable
 
-creatureAmt = 0                                     #Total amount of valid creatures found inside the level
-creatureFull = []                                   #Creature attribute table
-creatureFullByte = []                               #Creature attribute table (8-bit mode)
-
-if (os.path.getsize(fileName) != stateSize) and (args.importmode == '0'):
-    print("ERROR: Save state has the wrong file size. Has the correct file been chosen?")
-    file.close()
-    sys.exit()
-if ((os.path.getsize(fileName) != romSize) and (args.importmode == '1')):
-    print("ERROR: ROM has the wrong file size. Has the correct file been chosen?")
-    file.close()
-    sys.exit()
-
-if (re.search('[^0-9]',levelFile)):                 #For exportmode 1, we need to find out which level this is, so look at the numbers in the level file.
-    lIndex = int(re.sub('[^0-9]', '', levelFile))
-    print("Found level index:",lIndex)
-elif not (re.search('[^0-9]',levelFile)) and (args.importmode == 1): 
-    print("ERROR: Can not find which level to import from. Create a level file with a number (0-15) and then try again")
-    file.close()
-    sys.exit()
-
 #INCOMPLETE: Objects can be created in Tiled with an included sprite. Then they can be added to this table in succession
 creatureSets = ["Woody.tsx",
                 None,
@@ -107,6 +57,85 @@ def findFile(name, path):
         if name in files:
             return os.path.join(root, name)
 
+#The creature tilesets are indexed once (file name -> path relative to the Creatures folder) and the index is cached in this file next to the script
+#The cache is kept per Creatures folder and is thrown away as soon as the modification time of any of the scanned folders changes
+#Only the creatureIndexSize most recently scanned Creatures folders are kept, older ones are scanned again if they are used
+creatureIndexFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "creatureindex.json")
+creatureIndexSize = 8
+
+#Scans path for .tsx files, the first file found with a given name is used just like findFile does
+#Returns the index and the modification time of every folder that was scanned
+def scanCreatureIndex(path):
+    index = {}
+    folderTimes = {}
+    for root, dirs, files in os.walk(path):
+        dirs.sort()                                 #Same order on every system, so the same file wins if a name shows up twice
+        folderTimes[os.path.relpath(root, path)] = os.stat(root).st_mtime_ns
+        for name in sorted(files):
+            if name.lower().endswith(".tsx") and (name not in index):
+                index[name] = os.path.relpath(os.path.join(root, name), path).replace(os.sep, "/")
+    return index, folderTimes
+
+#Returns the index of creature tilesets in path, from the cache if none of the folders have changed since they were scanned
+def readCreatureIndex(path):
+    import json
+    key = os.path.abspath(path)
+    try:
+        with open(creatureIndexFile, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    entry = cache.get(key)
+    if entry != None:
+        try:
+            if all(os.stat(os.path.join(path, folder)).st_mtime_ns == mtime for folder, mtime in entry["folders"].items()):
+                return entry["index"]
+        except OSError:                             #A folder was removed, so the index has to be rebuilt
+            pass
+    if not os.path.isdir(path):
+        return {}
+    index, folderTimes = scanCreatureIndex(path)
+    cache.pop(key, None)                            #Entries are kept in the order they were scanned, the newest last
+    cache[key] = {"folders": folderTimes, "index": index}
+    for oldKey in list(cache)[:-creatureIndexSize]:
+        del cache[oldKey]
+    writeCreatureIndex(cache)
+    return index
+
+#Saves the creature index cache. It's written to a temporary file that is renamed into place once complete,
+#so an import running in another process (such as --all --workers) never reads half a file
+def writeCreatureIndex(cache):
+    import json
+    import tempfile
+    tempName = None
+    try:
+        handle, tempName = tempfile.mkstemp(dir=os.path.dirname(creatureIndexFile), suffix=".tmp")
+        with os.fdopen(handle, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tempName, creatureIndexFile)
+        tempName = None
+    except OSError:                                 #The cache is only a speed up, the index still works if it can't be saved
+        pass
+    finally:
+        if tempName != None:
+            try:
+                os.remove(tempName)
+            except OSError:
+                pass
+
+#Builds the list of creature tilesets for the map from the index, as (creature slot, path relative to the Creatures folder)
+#Tilesets in creatureSets are used for their slot. Any other tileset named after its slot, like "12 - Name.tsx" or "12.tsx", is picked up automatically
+def creatureTilesets(index):
+    slots = {}
+    for a, name in enumerate(creatureSets):
+        if (name != None) and (name in index):
+            slots[a] = index[name]
+    for name, relPath in index.items():
+        number = re.match("([0-9]+)( - .*)?\\.tsx$", name, re.IGNORECASE)
+        if number and (int(number.group(1)) < len(creatureSets)) and (int(number.group(1)) not in slots):
+            slots[int(number.group(1))] = relPath
+    return sorted(slots.items())
+
 #This list holds the specific width for each level. 'None' is there because it's Really Inside, which doesn't even use 2D tiles
 lWidth = [
     256,
@@ -280,114 +309,74 @@ creatureEntryByte = [
     "48. UNKNOWN E HI"
 ]
 
-def readMap():
-    columnSize = 64                             #Size of the columns used for formatting the output file
+#Reads the level tiles from ROM, the RNC packed level at lOffset[lIndex] is unpacked in memory by rnc.py (so the external RNC ProPack tool isn't needed)
+#Levels that have been unpacked before come from the cache in romcache.py instead, unless useCache is False
+#The ROM file and level index have to be checked before this is called. rncPath is no longer used and only kept so older callers still work
+#Returns None if the level data in the ROM can't be unpacked
+def readRomLevel(fileName, lIndex, rncPath=None, useCache=True):
+    import mmap                                 #Only needed for import mode 1
+    import romcache
+    print("\n--Import mode selected: 1 (ROM)\n")
+    with open(fileName, "rb") as romFile:
+        with mmap.mmap(romFile.fileno(), 0, access=mmap.ACCESS_READ) as rom:   #Only the packed level is read from the ROM, not the whole file
+            try:
+                level, cached = romcache.unpackCached(rom, int(lOffset[lIndex], 16), romcache.cacheFolder if useCache else None)
+            except ValueError as error:
+                print("ERROR:", error)
+                return None
+    if useCache:
+        print(romcache.cacheStats())
+    return level
+
+#Formats the level tiles (a list of 8192 tile values, from a save state or ROM) into Tiled's CSV format, or base64 if another layerFormat is given (see tiledlayer.py)
+#Every row of the level becomes one line in CSV, so columnSize should be the width of the level. Returns the whole layer as a single string
+#If chunkSize is given, the layer is written as the chunks of an infinite map instead and chunks that only hold empty tiles are left out
+def readMap(level, columnSize=64, layerFormat="csv", chunkSize=None):
     levelSize = int("2000", 16)                 #Size of the level in hex (should be 8192 or 0x2000, which is full size)
-    insertAmt = levelSize/columnSize            #Defines how many times newlines have to be inserted into the list
-    if (args.importmode == '0'):
-        file.seek(levelOffset, 0)                   #Seek to offset where the level tiles are located before data is read
-        number=list(file.read(levelSize))           #Read the entire level from RAM, specified from offset
-    elif (args.importmode == '1'):
-        if rncPath == None:
-            print("ERROR: No path was specified for RNC runtimes!")
-            file.close()
-            sys.exit()
-        if lOffset[lIndex] == None:                                 #Really Inside (3D level, self-explanatory) and The Claw (unknown as of know)
-            print("ERROR: Level not supported.")
-            file.close()
-            sys.exit()
-        if (lIndex < 0) or (lIndex > 16):
-            print("ERROR: Invalid level index!")
-            file.close()
-            sys.exit()
-        print("\n--Import mode selected: 1 (ROM)\n")
-        subprocess.run([rncPath, "u", fileName, "TS_UNCOMPRESSED.bin", "-i={0}".format(lOffset[lIndex])])
-        print("----HELLO----", "-i={0}".format(lOffset[lIndex]))
-        packLvl = open("TS_UNCOMPRESSED.bin","r+b")
-        number=list(packLvl.read())
-    
-    starAmt = 0                                 #Keeps track of the total amount of stars, may be helpful when trying to reach 50
-    i = 0
-    while i < len(number):
-        if (int(number[i]) == 254) or (int(number[i]) == 255):
-            starAmt += 1
-        i += 1
-
-    #The list is a straight string from number to number, there has to be a colon between each number which is done here
-    i = 1
-    while i < len(number):                      #insertAmt is being cast into integer just in case the divison becomes a decimal number
-        number.insert(i, ",")                   #Newline has to be inserted, otherwise the output will have one giant row
-        i += 2                                  #Inserted every other line
-        
-    #Newline has to be inserted, otherwise the output will have one giant row
-    insertAmt = int(len(number))/columnSize    #Previous loop changed the size of the list, so this reevaluates it
-    insertAmt = int(insertAmt)
-    i = 1
-    while i < int(insertAmt):                   #insertAmt is being cast into integer just in case the divison becomes a decimal number
-        number.insert(columnSize*i, "\n")       #Using columnSize as a variable so it can be adjusted easier
-        i += 1
-    print(levelSize, "bytes read starting at offset", hex(objectOffset),"\nTotal stars:",starAmt)  #Tells us how much was read at said offset
-    return number
-
-#Because there are 48 bytes per creature and there are 48 creatures, we can do a nested loop that reads 48 bytes and then increments z
-#z will then be used as the creature number (0 = first creature, 1 = second creature, etc)
-def readCreatures(ByteMode):
-    global creatureFull
-    global creatureAmt
-    global creatureFullByte
+    number = bytes(level)
+    starAmt = number.count(254) + number.count(255)     #Keeps track of the total amount of stars, may be helpful when trying to reach 50
+    print(levelSize, "bytes read starting at offset", hex(levelOffset),"\nTotal stars:",starAmt)  #Tells us how much was read at said offset
+    if chunkSize != None:
+        return encodeChunks(number, columnSize, layerFormat, chunkSize)
+    return encodeLayer(number, layerFormat, columnSize)
+
+#The creature table is 48 creatures of 48 bytes each. The whole table is read in one go and unpacked with struct, 24 16-bit values per creature
+#Both the 16-bit values (in the order of creatureEntry) and the 8-bit values (creatureEntryByte) are taken from the same bytes
+#Returns the 16-bit table, the 8-bit table and the amount of creatures in the level
+def readCreatureTable(state):
     readAll = False             #If false, the function only loads as many creatures that exist in the level. If true, it loads the full raster
     reformatValues = True       #If true, all read values will be properly converted from unsigned to signed integers
-    calcus = 0
-    if readAll == True:         
-        creatureAmt = 48        #We already know that if all creatures are being read, the amount is going to be 48
-    i = 0
-    x = 0
-    z = 0
-    while z < 48:               #We're making a two-dimensional loop here, first we're looking to load 48 creatures
-        while i < 48:           #Then, we're going to load 48 values from each creature (or 24 16-bit values)
-            file.seek(objectOffset+(z*48)+i, 0)                   #Seek to offset where the the objects are loaded
-            enemy=list(file.read(2))                        #Read two bytes at a time (we want to store 16-bits into a single integer)
-            calcus = enemy[0] + (256 * enemy[1])            #Low byte + (256 * high byte), when a value reaches 256, high is +1 and low wraps to 0
-            if ((i == 0) and (calcus == 0)) and readAll == False:   
-                file.seek(objectOffset+(z*48)+2, 0)               #This is hard-coded to go through all 48 possible creatures, controlled by readAll 
-                enemy=list(file.read(2))                    #Read two bytes
-                calcus = enemy[0] + (256 * enemy[1])        #Read as low byte + (256 * high byte), little endian to integer conversion
-                if calcus == 0:                             #All valid creatures have a X-pos beyond 0, so if 0 is read, we know there are no more
-                    creatureAmt = z                         #At this point, the amount of creatures are known
-                    z = 48                                  #We're setting this to 48 in order to get out of the loop
-                    break
-            creatureDict[creatureEntry[x]] = calcus
-            creatureFull.append(calcus)
-            i += 2
-            x += 1
-        i = 0
-        while i < 48:                                       #This is a terrible solution, but for now, another loop after the first one is added in tandem
-            file.seek(objectOffset+(z*48)+i, 0)                   #This solution is here because we want some values as 8-bit instead of 16-bit
-            enemy2=list(file.read(1))                       #I didn't want to tamper with the original function
-            enemyVal = int(enemy2[0])
-            creatureFullByte.append(enemyVal)
-            i += 1
-        i = 0
-        z += 1
-        x = 0
+    table = bytes(state.creatures)
+    creatureStruct = struct.Struct("<{0}H".format(len(creatureEntry)))     #Little endian, low byte + (256 * high byte)
+    creatureAmt = len(table) // creatureStruct.size
+    if readAll == False:
+        #All valid creatures have a X-pos or Y-pos beyond 0, so the first creature where both are 0 marks the end of the table
+        #The X and Y-pos of every creature are read as a single 32-bit value, so this is one check per creature
+        positions = [i[0] for i in struct.iter_unpack("<I{0}x".format(creatureStruct.size-4), table)]
+        if 0 in positions:
+            creatureAmt = positions.index(0)
+    creatureFull = []           #Creature attribute table
+    for entry in creatureStruct.iter_unpack(table[:creatureAmt*creatureStruct.size]):
+        creatureFull.extend(entry)
+    if creatureAmt > 0:
+        creatureDict.update(zip(creatureEntry, creatureFull[-len(creatureEntry):]))    #The dictionary holds the values of the last creature
     if reformatValues == True:
-        i = 0
-        y = 0
-        while i < creatureAmt:
-            while y < 24:
-                if creatureFull[y+(24*i)] > 32768:                     #Max value of a signed 16-bit integer, if value is bigger, we know we need to convert it
-                    creatureFull[y+(24*i)] = 65536 - creatureFull[y+(24*i)]   #All values will be negative with this offset, (FFFF = -1), so this formula should solve it
-                    creatureFull[y+(24*i)] = creatureFull[y+(24*i)] * -1      #The remainder is then inverted to actually turn it into a negative value
-                y += 1
-            i += 1
-            y = 0
+        #Max value of a signed 16-bit integer, if value is bigger, we know we need to convert it. All values will be negative with this offset, (FFFF = -1)
+        creatureFull = [i - 65536 if i > 32768 else i for i in creatureFull]
+    creatureFullByte = list(table[:creatureAmt*creatureStruct.size])   #Creature attribute table (8-bit mode)
+    return creatureFull, creatureFullByte, creatureAmt
+
+#Returns the creature table (16-bit or 8-bit values depending on ByteMode) and the amount of creatures in the level
+#Both tables come from the same read, use readCreatureTable if both are needed
+def readCreatures(state, ByteMode):
+    creatureFull, creatureFullByte, creatureAmt = readCreatureTable(state)
     if ByteMode == True:
-        return creatureFullByte
+        return creatureFullByte, creatureAmt
     else:
-        return creatureFull
+        return creatureFull, creatureAmt
 
 #This is a test or debug function that just dumps creature variables into a text file in the same folder as this script
-def writeOutput():
+def writeOutput(creatureFull, creatureAmt):
     filename = 'output_obj.txt'
     outfile = open(filename, 'w')
     i = 0
@@ -405,7 +394,8 @@ def writeOutput():
         i = 0
     outfile.close()
 
-def editFile():
+def editFile(levelFile, state):
+    creatureFull, creatureAmt = readCreatures(state, False)
     x = 0
     y = 0
     z = 0
@@ -454,23 +444,21 @@ def editFile():
         
     writeLevel.close()
 
-def makeFile():
-    global creatureAmt
+#Creates a new .tmx file for Tiled. The level tiles are read from level, creatures and other objects are only read if a save state is given
+#layerFormat is how the tile layer is stored, "csv" (default), "base64", "zlib", "gzip" or "zstd". With chunkSize, the map is made infinite and stored in chunks
+def makeFile(levelFile, tiledPath, level, lIndex, state=None, tileset=None, layerFormat="csv", chunkSize=None):
     outfile = open(levelFile, 'w')
-    if (args.importmode == '1'):
-        w = lWidth[lIndex]
-    elif (args.importmode == '0'):
-        w = lWidth[lIndex[0]]
+    w = lWidth[lIndex]
     h = int(8192 / w)                       #Levels can be 8192 bytes max, level width is stored in a table so we can divide max size with that width to get the height
     print("Level dimensions:",w,"x",h,"tiles")
     
     #This is the formatting of Tiled's map files, this may change though with later versions of Tiled. If so, this list has to be adjusted accordingly
     formatList = [
         "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n",
-        "<map version=\"1.10\" tiledversion=\"1.10.2\" orientation=\"orthogonal\" renderorder=\"right-down\" width=\"{0}\" height=\"{1}\" tilewidth=\"32\" tileheight=\"32\" infinite=\"0\" nextlayerid=\"{2}\" nextobjectid=\"{3}\">\n",
+        "<map version=\"1.10\" tiledversion=\"1.10.2\" orientation=\"orthogonal\" renderorder=\"right-down\" width=\"{0}\" height=\"{1}\" tilewidth=\"32\" tileheight=\"32\" infinite=\"{4}\" nextlayerid=\"{2}\" nextobjectid=\"{3}\">\n",
         "<tileset firstgid=\"{0}\" source=\"{1}\"/>\n",
         "<layer id=\"{0}\" name=\"{1}\" width=\"{2}\" height=\"{3}\" offsetx=\"{4}\" offsety=\"{5}\">\n",
-        "<data encoding=\"csv\">\n",
+        "<data {0}>\n",
         "\n</data>\n",
         "</layer>\n",
         "<objectgroup id=\"{0}\" name=\"{1}{2}\" visible=\"{3}\" index=\"{4}\">\n",
@@ -478,9 +466,9 @@ def makeFile():
         "</objectgroup>\n",
         "</map>\n"
     ]
-    fullMap = readMap()                                     #Read the map raster
+    fullMap = readMap(level, w, layerFormat, chunkSize)     #Read the map raster, one line per row of the level in CSV
     mapSetup = []
-    if (args.importmode == '1'):
+    if state == None:                                       #Import mode 1 (ROM), only the level tiles are available
         creatureAmt = 0
         woodyY = 0
         woodyX = 0
@@ -490,19 +478,17 @@ def makeFile():
         borderH = 0
         levelID = str(lIndex)
         levelTitle = str(lName[lIndex])
-    elif (args.importmode == '0'):
-        fullCreatures = readCreatures(False)                    #Read in 16-bit mode (useful for all coordinate variables)
-        fullCreaturesByte = readCreatures(True)                 #Read in 8-bit mode (required for some variables as the 16-bit mode read can end up combining two unrelated values)
+    else:
+        #16-bit values are useful for all coordinate variables, 8-bit values are required for some variables as the 16-bit values can end up combining two unrelated values
+        fullCreatures, fullCreaturesByte, creatureAmt = readCreatureTable(state)
         print("Number of creatures loaded:",creatureAmt)        #This tells us how many creatures are actually put into the level
-        levelID = str(lIndex[0])
-        levelTitle = str(lName[lIndex[0]])
-        file.seek(stateOffset+int("1730", 16), 0)               #If available, Woody's coordinates can be read from the save state
-        mapSetup = list(file.read(6))
+        levelID = str(lIndex)
+        levelTitle = str(lName[lIndex])
+        mapSetup = state.ram[int("1730", 16):int("1736", 16)]   #If available, Woody's coordinates can be read from the save state
         woodyX = mapSetup[0] + (mapSetup[1]*256)
         woodyY = mapSetup[4] + (mapSetup[5]*256)
     
-        file.seek(stateOffset+int("15A", 16), 0)                #Read the defined border size from RAM
-        mapSetup = list(file.read(8))
+        mapSetup = state.ram[int("15A", 16):int("162", 16)]     #Read the defined border size from RAM
     
         #Game stores border as variables X-start and X-end. By taking X-end and subtracting it with X-start, the width can be calculated
         #This is required because Tiled only has a startin X and Y position for a region, and then uses a width offset from those positions
@@ -513,34 +499,27 @@ def makeFile():
     x = 0
     for i in formatList:
         if x == 1:
-            reformat = "\n %s" %(i.format(w,h,0,0))
+            reformat = "\n %s" %(i.format(w,h,0,0,int(chunkSize != None)))
             outfile.write(reformat)
         elif x == 2:
-            if args.tileset == None:                                                 #If no tileset was specified, then choose this placeholder
+            if tileset == None:                                                 #If no tileset was specified, then choose this placeholder
                 tileSet   = levelID+" - "+levelTitle+".tsx"                          #The placeholder is simply named after the id and title of the level
                 reformat = "\n %s" %(i.format(1,tiledPath+"/Tilesets/"+tileSet))
             else:
-                tileSet = args.tileset
+                tileSet = tileset
                 reformat = "\n %s" %(i.format(1,tiledPath+"/Tilesets/"+tileSet))
             outfile.write(reformat)
-            a = 0
-            while a < 72:
-                if findFile(creatureSets[a], tiledPath+"/Tilesets"+"/Creatures"):
-                    reformat = "\n %s" %(i.format(257+a,tiledPath+"/Tilesets"+"/Creatures/"+creatureSets[a]))
-                    outfile.write(reformat)
-                else:
-                    #This part is used to print a placeholder icon for the creatures that don't yet have one
-                    #reformat = "\n %s" %(i.format(257+a,tiledPath+"/Tilesets"+"/Creatures/"+"Placeholder.tsx"))    #Placeholder balloon if tilesets do not exist
-                    #outfile.write(reformat)
-                    pass
-                a += 1
+            #Creatures without a tileset are left out, a placeholder icon could be used for them instead:
+            #reformat = "\n %s" %(i.format(257+a,tiledPath+"/Tilesets"+"/Creatures/"+"Placeholder.tsx"))    #Placeholder balloon if tilesets do not exist
+            for a, relPath in creatureTilesets(readCreatureIndex(tiledPath+"/Tilesets"+"/Creatures")):
+                reformat = "\n %s" %(i.format(257+a,tiledPath+"/Tilesets"+"/Creatures/"+relPath))
+                outfile.write(reformat)
         elif x == 3:
             reformat = "\n %s" %(i.format(0,"Tiles",w,h,0,0))
             outfile.write(reformat)
         elif x == 4:
-            outfile.write(i)
-            for i in fullMap:
-                outfile.write(str(i))
+            outfile.write(i.format(dataAttributes(layerFormat)))
+            outfile.write(fullMap)
         elif x == 7:
             reformat = "\n %s" %(i.format(0,"Level","",1,0))
             outfile.write(reformat)
@@ -587,7 +566,7 @@ def makeFile():
                 hitboxX = fullCreatures[(y*24)+0] - fullCreatures[(y*24)+16]
                 hitboxY = fullCreatures[(y*24)+1] + fullCreatures[(y*24)+17]
                     
-                reformat = "\n %s" %(i.format(0,258+creatureFull[(y*24)+11],"01 - Position","Creature",creatureFull[(y*24)+0],creatureFull[(y*24)+1],None,None,0))
+                reformat = "\n %s" %(i.format(0,258+fullCreatures[(y*24)+11],"01 - Position","Creature",fullCreatures[(y*24)+0],fullCreatures[(y*24)+1],None,None,0))
                 outfile.write(reformat)
                 reformat = "\n %s" %(i.format(0,0,"02 - Patrolling zone","Creature",fullCreatures[(y*24)+2],fullCreatures[(y*24)+3],patrolX,patrolY,0))
                 outfile.write(reformat)
@@ -605,22 +584,194 @@ def makeFile():
         x += 1
     outfile.close()    
 
-if tiledPath == None:
-    print("ERROR: No map path argument was specified.")
-    file.close()
-    sys.exit()
-if levelFile == "%mapfile":
-    print("ERROR: No level file has been specified.")
-    file.close()
-    sys.exit()
-
-if (args.importmode == '0'):
-    file.seek(levelIndex, 0)                                #Read the level index to figure out what level is being handled
-    lIndex=list(file.read(1))                               #The name of the level is not stored in RAM, so a table is used to print it here
-    print("Level loaded from state:",lIndex[0],"-",lName[lIndex[0]])                       #Level number index + level name printed
-
-if createNew == True:    
-    makeFile()                                          #Create a new .tmx file for Tiled to handle
-else:
-    editFile()                                          #Edit an existing Tiled map file to add the creatures and map tiles in there
-file.close()                                            #Finally the save state/RAM dump is closed
\ No newline at end of file
+#Imports one level into a new (or existing) Tiled map file, from a save state (importmode '0') or ROM (importmode '1')
+#In import mode 1, the level index has to be given as there's no way to read it from the ROM. Returns False if the level can't be read
+def importLevel(fileName, levelFile, tiledPath, importmode='0', tileset=None, rncPath=None, lIndex=None, layerFormat="csv", chunkSize=None, useCache=True):
+    state = None
+    if (importmode == '0'):
+        state = SaveState(fileName)                         #The whole save state is read once, level tiles, creatures and everything else are read from here
+        lIndex = state.levelIndex()                         #Read the level index to figure out what level is being handled
+        print("Level loaded from state:",lIndex,"-",lName[lIndex])                         #Level number index + level name printed
+    if createNew == True:
+        if state == None:
+            level = readRomLevel(fileName, lIndex, None, useCache)
+            if level == None:
+                return False
+        else:
+            level = state.level
+        makeFile(levelFile, tiledPath, level, lIndex, state, tileset, layerFormat, chunkSize)   #Create a new .tmx file for Tiled to handle
+    else:
+        editFile(levelFile, state)                          #Edit an existing Tiled map file to add the creatures and map tiles in there
+
+#ROM memory-mapped by openRom in every process of importRomBatch, so it's only opened once per process and not once per level
+romMap = None
+
+def openRom(fileName):
+    import mmap
+    global romMap
+    with open(fileName, "rb") as romFile:
+        romMap = mmap.mmap(romFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+#Imports one level from the ROM opened by openRom into the folder tiledPath as "N - Name.tmx", run by importRomBatch in a separate process
+#Returns (lIndex, map file, packed size, True if the level came from the cache, seconds spent unpacking, seconds spent writing the map, error message or None)
+def importRomLevel(lIndex, tiledPath, layerFormat="csv", chunkSize=None, useCache=True):
+    import contextlib
+    import io
+    import time
+    import rnc
+    import romcache
+    levelFile = os.path.join(tiledPath, "{0} - {1}.tmx".format(lIndex, lName[lIndex]))
+    start = time.perf_counter()
+    try:
+        packSize = rnc.headerSize + rnc.readHeader(romMap, int(lOffset[lIndex], 16))[1]
+        level, cached = romcache.unpackCached(romMap, int(lOffset[lIndex], 16), romcache.cacheFolder if useCache else None)
+    except ValueError as error:
+        return lIndex, levelFile, 0, False, 0, 0, str(error)
+    unpackTime = time.perf_counter() - start
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):         #The level stats of every process would end up mixed together, the summary is printed instead
+        makeFile(levelFile, tiledPath, level, lIndex, None, None, layerFormat, chunkSize)
+    return lIndex, levelFile, packSize, cached, unpackTime, time.perf_counter() - start, None
+
+#Imports every level that has an offset in lOffset from the ROM into tiledPath, one "N - Name.tmx" map per level
+#The levels are spread over a pool of processes (workers is the amount, all CPU cores by default). Returns False if any level couldn't be imported
+def importRomBatch(fileName, tiledPath, workers=None, layerFormat="csv", chunkSize=None, useCache=True):
+    import concurrent.futures
+    import functools
+    import time
+    import romcache
+    levels = [i for i in range(len(lOffset)) if lOffset[i] != None]   #Really Inside The Claw Machine and The Claw have no tiles to import
+    print("\n--Import mode selected: 1 (ROM), all",len(levels),"levels into",tiledPath,"\n")
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=openRom, initargs=(fileName,)) as pool:
+        results = list(pool.map(functools.partial(importRomLevel, tiledPath=tiledPath, layerFormat=layerFormat, chunkSize=chunkSize, useCache=useCache), levels))
+    elapsed = time.perf_counter() - start
+    print("{0:>5}  {1:<32}{2:>8}{3:>10}{4:>12}{5:>11}{6:>7}".format("Level", "Name", "Packed", "Map size", "Unpack (ms)", "Write (ms)", "Cache"))
+    failed = 0
+    for lIndex, levelFile, packSize, cached, unpackTime, writeTime, error in results:
+        if error != None:
+            print("{0:>5}  {1:<32}ERROR: {2}".format(lIndex, lName[lIndex], error))
+            failed += 1
+            continue
+        print("{0:>5}  {1:<32}{2:>8}{3:>10}{4:>12.1f}{5:>11.1f}{6:>7}".format(lIndex, lName[lIndex], packSize, os.path.getsize(levelFile), unpackTime*1000, writeTime*1000, ("hit" if cached else "miss") if useCache else "-"))
+    print("\nImported",len(levels)-failed,"of",len(levels),"levels in {0:.0f} ms".format(elapsed*1000))
+    if useCache:                                        #Every process has its own counts, so they're added up from the results
+        hitAmt = sum(1 for i in results if i[3])
+        print(romcache.cacheStats(hitAmt, len(levels)-failed-hitAmt))
+    return failed == 0
+
+if __name__ == "__main__":
+    #Argument parser function
+    parser = argparse.ArgumentParser(
+                        prog='State2Level',
+                        description='Toy Story SNES Level Exporter - Read a BSNES-Plus or other SNES emulator save state and export the level data to Tiled.',
+                        epilog='Usage: state2level INPUT OUTPUT MAPPATH TILESET')
+
+    parser.add_argument('statefile')                     #The path to the save state has to be provided in full inside the command string
+    parser.add_argument('levelfile', nargs='?')          #Tiled supports parsing the filename that it is currently editing into this script, %mapfile
+    parser.add_argument('levelpath', nargs='?')          #This is sent directly from a Tiled variable called %mappath
+    parser.add_argument('--tileset',required=False)      #Optional: Tileset used for the level file. Not technically required, but the user definitely will want one
+    parser.add_argument('--importmode', 
+                        metavar='M',
+                        help='Import mode (0-1). 0 if importing from a save state, 1 if importing directly from ROM',
+                        required=False,
+                        default='0')
+    parser.add_argument('--rnc', 
+                        metavar='R',
+                        help='No longer needed, ROM levels are unpacked by rnc.py. Kept so older Tiled commands still work',
+                        required=False,
+                        default=None)   
+    parser.add_argument('--layerformat', 
+                        metavar='F',
+                        choices=list(layerFormats),
+                        help='How the tile layer is stored in the map: csv (default), base64, zlib, gzip or zstd (base64 compressed with zlib, gzip or zstd)',
+                        required=False,
+                        default='csv')
+    parser.add_argument('--chunks', 
+                        metavar='N',
+                        type=int,
+                        nargs='?',
+                        const=16,
+                        help='Make the map infinite and store the tile layer in NxN chunks (16 if N is left out), chunks with only empty tiles are left out',
+                        required=False,
+                        default=None)
+    parser.add_argument('--all', 
+                        metavar='D',
+                        help='Import every level from the ROM into the folder D as "N - Name.tmx" maps, the map file and path are not needed then',
+                        required=False,
+                        default=None)
+    parser.add_argument('--workers', 
+                        metavar='W',
+                        type=int,
+                        help='Amount of processes used with --all (all CPU cores by default)',
+                        required=False,
+                        default=None)
+    parser.add_argument('--nocache', 
+                        action='store_true',
+                        help='Always unpack the levels from the ROM, without using or filling the cache of unpacked levels (see romcache.py)')
+
+    args = parser.parse_args()
+    if args.all != None:                                #Batch import of every level in the ROM
+        if os.path.getsize(args.statefile) != romSize:
+            print("ERROR: ROM has the wrong file size. Has the correct file been chosen?")
+            sys.exit()
+        if (args.chunks != None) and (args.chunks < 1):
+            print("ERROR: Chunk size has to be at least 1")
+            sys.exit()
+        if (args.layerformat == "zstd") and (loadZstd() == None):
+            print("ERROR: zstd compression requires Python 3.14 or the zstandard module (python -m pip install zstandard)")
+            sys.exit()
+        os.makedirs(args.all, exist_ok=True)
+        if not importRomBatch(args.statefile, args.all, args.workers, args.layerformat, args.chunks, not args.nocache):
+            sys.exit(1)
+        sys.exit()
+
+    if (args.levelfile == None) or (args.levelpath == None):
+        parser.error("the following arguments are required: levelfile, levelpath (or use --all)")
+
+    print("Save state file:", args.statefile,"\nLevel file:",args.levelfile,"\nTile set:",args.tileset)
+
+    fileName = args.statefile                           #Save state to read the level data from
+    levelFile = args.levelfile                          #Tiled level file, the data read from the save state will be exported here
+    tiledPath = args.levelpath                          #Path to the map file, as parsed from Tiled
+    rncPath = args.rnc                                  #Path to RNC runtimes (no longer used, see rnc.py)
+    lIndex = None
+
+    if (os.path.getsize(fileName) != stateSize) and (args.importmode == '0'):
+        print("ERROR: Save state has the wrong file size. Has the correct file been chosen?")
+        sys.exit()
+    if ((os.path.getsize(fileName) != romSize) and (args.importmode == '1')):
+        print("ERROR: ROM has the wrong file size. Has the correct file been chosen?")
+        sys.exit()
+
+    if (re.search('[^0-9]',levelFile)):                 #For exportmode 1, we need to find out which level this is, so look at the numbers in the level file.
+        lIndex = int(re.sub('[^0-9]', '', levelFile))
+        print("Found level index:",lIndex)
+    elif not (re.search('[^0-9]',levelFile)) and (args.importmode == 1): 
+        print("ERROR: Can not find which level to import from. Create a level file with a number (0-15) and then try again")
+        sys.exit()
+
+    if tiledPath == None:
+        print("ERROR: No map path argument was specified.")
+        sys.exit()
+    if levelFile == "%mapfile":
+        print("ERROR: No level file has been specified.")
+        sys.exit()
+    if (args.importmode == '1'):
+        if (lIndex < 0) or (lIndex > 16):
+            print("ERROR: Invalid level index!")
+            sys.exit()
+        if lOffset[lIndex] == None:                                 #Really Inside (3D level, self-explanatory) and The Claw (unknown as of know)
+            print("ERROR: Level not supported.")
+            sys.exit()
+
+    if (args.layerformat == "zstd") and (loadZstd() == None):
+        print("ERROR: zstd compression requires Python 3.14 or the zstandard module (python -m pip install zstandard)")
+        sys.exit()
+
+    if (args.chunks != None) and (args.chunks < 1):
+        print("ERROR: Chunk size has to be at least 1")
+        sys.exit()
+
+    if importLevel(fileName, levelFile, tiledPath, args.importmode, args.tileset, rncPath, lIndex, args.layerformat, args.chunks, not args.nocache) == False:
+        sys.exit()
@@ -0,0 +1,176 @@
+#Shared tile layer encoding for the Tiled map tools (state2level.py and level2state.py)
+#Tiled can store the tiles of a layer as CSV text, or as base64 that is optionally compressed with zlib, gzip or zstd
+#A level tile is a single byte and the level tileset starts at gid 1, so the tile value is the gid as it is written to the map
+
+import base64
+import gzip
+import re
+import zlib
+
+#Layer formats that can be written, as (encoding, compression) attributes of the <data> element
+layerFormats = {
+    "csv":      ("csv", None),
+    "base64":   ("base64", None),
+    "zlib":     ("base64", "zlib"),
+    "gzip":     ("base64", "gzip"),
+    "zstd":     ("base64", "zstd")
+}
+
+#zstd is not part of the standard library before Python 3.14, so the zstandard module is used on older versions
+#Returns None if neither is available
+def loadZstd():
+    try:
+        from compression import zstd
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+#Attributes of the <data> element for a layer format, such as: encoding="base64" compression="zlib"
+def dataAttributes(layerFormat):
+    encoding, compression = layerFormats[layerFormat]
+    if compression == None:
+        return "encoding=\"{0}\"".format(encoding)
+    return "encoding=\"{0}\" compression=\"{1}\"".format(encoding, compression)
+
+def compress(data, compression):
+    if compression == "zlib":
+        return zlib.compress(data, 9)
+    if compression == "gzip":
+        return gzip.compress(data, 9, mtime=0)      #mtime=0 so the same level always gives the same file
+    if compression == "zstd":
+        zstd = loadZstd()
+        if zstd == None:
+            raise ValueError("zstd compression requires Python 3.14 or the zstandard module (python -m pip install zstandard)")
+        return zstd.compress(data)
+    raise ValueError("Unknown layer compression: {0}".format(compression))
+
+def decompress(data, compression):
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        zstd = loadZstd()
+        if zstd == None:
+            raise ValueError("zstd compressed maps require Python 3.14 or the zstandard module (python -m pip install zstandard)")
+        if hasattr(zstd, "ZstdDecompressor"):                   #zstandard needs the size of the output unless it is stored in the frame
+            return zstd.ZstdDecompressor().decompressobj().decompress(data)
+        return zstd.decompress(data)
+    raise ValueError("Unknown layer compression: {0}".format(compression))
+
+#Decodes a base64 (and optionally compressed) layer into the raw 32-bit little endian gids
+def decodeGids(text, encoding="base64", compression=None):
+    if encoding != "base64":
+        raise ValueError("Unknown layer encoding: {0}".format(encoding))
+    gids = base64.b64decode("".join(text.split()))
+    if compression != None:
+        gids = decompress(gids, compression)
+    if len(gids) % 4 != 0:
+        raise ValueError("Layer data is not a whole number of 32-bit gids ({0} bytes)".format(len(gids)))
+    return gids
+
+#Formats the level tiles as the text inside a <data> element. CSV has one line per row of the level, columnSize should be the width of the level
+def encodeLayer(level, layerFormat="csv", columnSize=64):
+    encoding, compression = layerFormats[layerFormat]
+    if encoding == "csv":
+        number = list(level)
+        rows = []
+        i = 0
+        while i < len(number):
+            rows.append(",".join(map(str, number[i:i+columnSize])))     #Every row is joined with commas in one go
+            i += columnSize
+        return ",\n".join(rows)                                         #Rows are separated by a comma and a newline like Tiled does it
+    #Base64 stores every gid as a 32-bit little endian value, so the tile byte is the low byte and the other three bytes are 0
+    level = bytes(level)
+    gids = bytearray(len(level)*4)
+    gids[0::4] = level
+    if compression != None:
+        gids = compress(bytes(gids), compression)
+    return base64.b64encode(gids).decode("ascii")
+
+#Reads the text inside a <data> element back into a list of tile values
+#Raises a ValueError if the layer can't be decoded, or if it holds gids that don't fit in a level byte (such as flipped tiles)
+def decodeLayer(text, encoding="csv", compression=None):
+    if (encoding == None) or (encoding == "csv"):
+        try:
+            return list(map(int, filter(None, "".join(text.split()).split(","))))   #Newlines and spaces are removed, then empty entries are skipped
+        except ValueError:
+            pass                                                #Something other than whitespace is mixed in with the numbers, clear it out below
+        newList = []
+        for ind in text.split(","):
+            und = re.sub('[^0-9]', '', ind)                     #Clear the newlines and spaces around the numbers
+            if und != "":                                       #There may still be empty entries, so we ignore those
+                newList.append(int(und))
+        return newList
+    gids = decodeGids(text, encoding, compression)
+    if any(gids[1::4]) or any(gids[2::4]) or any(gids[3::4]):
+        gid = next(int.from_bytes(gids[i:i+4], "little") for i in range(0, len(gids), 4) if gids[i+1:i+4] != b"\0\0\0")
+        raise ValueError("Layer holds gid {0}, only gids 0-255 fit in a level (flipped or rotated tiles are not supported)".format(gid))
+    return list(gids[0::4])
+
+#Same as decodeLayer, but the tiles are returned as a NumPy array of 64-bit integers so that gids that don't fit in a level byte can still be checked
+#CSV is parsed by NumPy in one go once the whitespace has been deleted, anything unusual in there falls back to decodeLayer
+def decodeLayerArray(text, encoding="csv", compression=None):
+    import numpy as np
+    import warnings
+    if (encoding == None) or (encoding == "csv"):
+        data = text.encode("utf-8").translate(None, b" \t\r\n")
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")                  #NumPy only warns if it can't read the whole string
+                return np.fromstring(data, dtype=np.int64, sep=",")
+        except (ValueError, DeprecationWarning):
+            return np.array(decodeLayer(text, encoding, compression), dtype=np.int64)
+    return np.frombuffer(decodeGids(text, encoding, compression), dtype="<u4").astype(np.int64)
+
+#Splits the level into chunkSize x chunkSize chunks for Tiled's infinite maps, chunks where every tile is 0 are left out
+#Returns the chunks as (x, y, tiles) in tile coordinates. Chunks that reach past the edge of the level are padded with 0
+def splitChunks(level, width, chunkSize=16):
+    level = bytes(level)
+    height = len(level) // width
+    chunks = []
+    for y in range(0, height, chunkSize):
+        for x in range(0, width, chunkSize):
+            tiles = bytearray(chunkSize*chunkSize)
+            for row in range(min(chunkSize, height-y)):
+                rowTiles = level[((y+row)*width)+x:((y+row)*width)+x+min(chunkSize, width-x)]
+                tiles[row*chunkSize:(row*chunkSize)+len(rowTiles)] = rowTiles
+            if any(tiles):
+                chunks.append((x, y, bytes(tiles)))
+    return chunks
+
+#Formats the level as the <chunk> elements inside the <data> element of an infinite map, every chunk is encoded as layerFormat
+def encodeChunks(level, width, layerFormat="csv", chunkSize=16):
+    text = []
+    for x, y, tiles in splitChunks(level, width, chunkSize):
+        text.append("<chunk x=\"{0}\" y=\"{1}\" width=\"{2}\" height=\"{2}\">\n{3}\n</chunk>".format(x, y, chunkSize, encodeLayer(tiles, layerFormat, chunkSize)))
+    return "\n".join(text)
+
+#Puts the chunks of an infinite map back together into a level of width x height tiles, chunks are given as (x, y, chunk width, chunk height, tiles)
+#Tiles missing from every chunk are 0. Raises a ValueError if a tile that isn't 0 lies outside the level, since it would be lost otherwise
+def joinChunks(chunks, width, height):
+    level = bytearray(width*height)
+    for x, y, chunkWidth, chunkHeight, tiles in chunks:
+        if len(tiles) != chunkWidth*chunkHeight:
+            raise ValueError("Chunk at {0},{1} holds {2} tiles instead of {3}".format(x, y, len(tiles), chunkWidth*chunkHeight))
+        if (len(tiles) > 0) and ((max(tiles) > 255) or (min(tiles) < 0)):
+            raise ValueError("Chunk at {0},{1} holds gid {2}, only gids 0-255 fit in a level".format(x, y, max(tiles) if max(tiles) > 255 else min(tiles)))
+        left = min(max(0, -x), chunkWidth)                      #Part of every row of the chunk that is inside the level
+        right = max(min(chunkWidth, width-x), left)
+        for row in range(chunkHeight):
+            rowTiles = tiles[row*chunkWidth:(row+1)*chunkWidth]
+            if (y+row < 0) or (y+row >= height):
+                inside = rowTiles[0:0]
+                outside = rowTiles
+            else:
+                inside = rowTiles[left:right]
+                outside = rowTiles[:left] + rowTiles[right:]
+            if any(outside):
+                raise ValueError("Chunk at {0},{1} has tiles outside of the {2}x{3} level (row {4})".format(x, y, width, height, y+row))
+            level[((y+row)*width)+x+left:((y+row)*width)+x+left+len(inside)] = bytes(inside)
+    return level